@@ -0,0 +1,349 @@
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+
+from indices import SIN_FILTRO, IndiceFiltros
+from metricas import etapa
+
+# Grano del cubo: toda combinación observada de estas dimensiones es una celda
+DIMENSIONES_CUBO = ['ESPECIALIDAD', 'SEXO', 'Rango de Edad', 'RANGO_DIAS', 'PRESENCIAL_REMOTO', 'SEGURO', 'ATENDIDO', 'MES']
+
+MEDIDAS = ['n', 'n_dias', 'suma', 'suma2']
+
+# Cuántas categorías se muestran antes de agrupar el resto en "Otras"
+TOP_N = int(os.environ.get('TOP_ESPECIALIDADES', '5'))
+
+
+class CuboCitas:
+    # Conteo, suma y suma de cuadrados de DIFERENCIA_DIAS por celda; las consultas
+    # filtran celdas con el mismo índice de posiciones que se usa para las filas
+
+    def __init__(self, df, dimensiones=DIMENSIONES_CUBO):
+        self.dimensiones = dimensiones
+        self._fijar_celdas(self._celdas(df))
+
+    def _celdas(self, df):
+        dias = df['DIFERENCIA_DIAS'].astype('float64')
+        base = df[self.dimensiones].assign(
+            n=1,
+            n_dias=dias.notna().astype('int64'),
+            suma=dias.fillna(0),
+            suma2=(dias ** 2).fillna(0),
+        )
+        return self._agrupar(base)
+
+    def _agrupar(self, base):
+        # dropna=False: las filas sin SEGURO siguen contando en las demás vistas
+        celdas = (base.groupby(self.dimensiones, observed=True, dropna=False)[MEDIDAS]
+                  .sum()
+                  .reset_index())
+        # Con vacíos en la clave, groupby devuelve los categóricos sin `ordered`; se
+        # restaura para que las celdas de distintos lotes se puedan concatenar
+        for d in self.dimensiones:
+            celdas[d] = celdas[d].astype(base[d].dtype)
+        return celdas
+
+    def _fijar_celdas(self, celdas):
+        self.celdas = celdas
+        self.indice = IndiceFiltros(celdas, self.dimensiones)
+
+    def con_filas(self, df, desde):
+        # Cubo nuevo con las filas df[desde:] sumadas: solo se agregan esas filas y sus
+        # celdas se combinan con las existentes. Las categorías nuevas deben ir al final
+        # (como las deja datos.anexar); si no, ValueError. No se reconstruye desde df: en
+        # modo por lotes df es solo el lote y se perderían los anteriores
+        nuevas = df.iloc[desde:]
+        viejas = self.celdas.copy(deep=False)
+        for d in self.dimensiones:
+            categorias = nuevas[d].cat.categories
+            if not categorias[:len(viejas[d].cat.categories)].equals(viejas[d].cat.categories):
+                raise ValueError(f"Las categorías de {d} cambiaron de orden; hay que reconstruir el cubo")
+            viejas[d] = viejas[d].cat.set_categories(categorias)
+        celdas = pd.concat([viejas, self._celdas(nuevas)], ignore_index=True)
+        otro = copy.copy(self)
+        otro._fijar_celdas(self._agrupar(celdas))
+        return otro
+
+    @etapa('agregado')
+    def agregar(self, por, filtros, no_nulos=()):
+        with etapa('filtro'):
+            celdas = self.indice.filtrar(self.celdas, filtros, no_nulos)
+        return celdas.groupby(por, observed=True)[MEDIDAS].sum()
+
+    def contar(self, por, filtros, no_nulos=()):
+        return self.agregar(por, filtros, no_nulos)['n']
+
+    @etapa('agregado')
+    def total(self, filtros, no_nulos=()):
+        with etapa('filtro'):
+            posiciones = self.indice.seleccionar(filtros, no_nulos)
+        n = self.celdas['n'].to_numpy()
+        return int(n.sum() if posiciones is None else n[posiciones].sum())
+
+    def estadisticas(self, por, filtros, no_nulos=()):
+        # Media y desviación estándar muestral a partir de los momentos acumulados
+        medidas = self.agregar(por, filtros, no_nulos)
+        n = medidas['n_dias'].astype('float64')
+        media = medidas['suma'] / n
+        varianza = (medidas['suma2'] - medidas['suma'] * media) / (n - 1)
+        return pd.DataFrame({
+            'n': medidas['n_dias'],
+            'mean': media,
+            'std': np.sqrt(varianza.clip(lower=0)),
+        })[medidas['n_dias'] > 0]
+
+
+def a_dias(serie):
+    # Días como float (NaN = vacío); las fechas se cuentan en días desde 1970-01-01
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        dias = serie.to_numpy().astype('datetime64[D]').astype('int64').astype('float64')
+        dias[serie.isna().to_numpy()] = np.nan
+        return dias
+    return serie.to_numpy(dtype='float64')
+
+
+class HistogramaDias:
+    # Citas por día exacto de espera para cada combinación de dimensiones, acumuladas a lo
+    # largo de los días: cualquier rango [a, b] sale de dos lecturas por combinación,
+    # sin importar cuántas filas tenga la tabla. Los vacíos de cada dimensión van en un
+    # casillero extra al final para que las vistas sin filtro los sigan contando
+
+    def __init__(self, df, dimensiones, columna='DIFERENCIA_DIAS'):
+        self.dimensiones = list(dimensiones)
+        self.columna = columna
+        self.categorias = {d: df[d].cat.categories for d in self.dimensiones}
+
+        codigos, dias = self._codigos(df)
+        self.primer_dia = int(dias.min()) if len(dias) else 0
+        n_dias = int(dias.max()) - self.primer_dia + 1 if len(dias) else 1
+        forma = [len(self.categorias[d]) + 1 for d in self.dimensiones] + [n_dias]
+        self.acumulado = self._acumular(codigos, dias, forma, np.int32 if len(dias) < 2 ** 31 else np.int64)
+
+    def _codigos(self, df):
+        # Código de cada dimensión (los vacíos al casillero extra) y día de las filas con día
+        dias = a_dias(df[self.columna])
+        validos = ~np.isnan(dias)
+        codigos = []
+        for d in self.dimensiones:
+            codigo = df[d].cat.codes.to_numpy()[validos].astype(np.int64)
+            codigo[codigo < 0] = len(self.categorias[d])
+            codigos.append(codigo)
+        return codigos, np.floor(dias[validos]).astype(np.int64)
+
+    def _acumular(self, codigos, dias, forma, tipo):
+        plano = np.ravel_multi_index(codigos + [dias - self.primer_dia], forma)
+        conteos = np.bincount(plano, minlength=int(np.prod(forma))).reshape(forma)
+        # acumulado[..., k] = citas con menos de primer_dia + k días de espera
+        return np.concatenate(
+            [np.zeros(forma[:-1] + [1], dtype=tipo), np.cumsum(conteos, axis=-1, dtype=tipo)], axis=-1
+        )
+
+    def con_filas(self, df, desde):
+        # Histograma nuevo con las filas df[desde:] sumadas. Las categorías nuevas se
+        # insertan antes del casillero de vacíos y el eje de días se extiende si hace
+        # falta; el costo depende del tamaño del histograma, no de las filas previas. Si las
+        # categorías cambiaron de orden, ValueError (como CuboCitas.con_filas)
+        nuevas = df.iloc[desde:]
+        if not self.acumulado[..., -1].any():
+            return type(self)(df, self.dimensiones, self.columna)
+        acumulado = self.acumulado
+        categorias = {}
+        for eje, d in enumerate(self.dimensiones):
+            viejas, todas = self.categorias[d], nuevas[d].cat.categories
+            if not todas[:len(viejas)].equals(viejas):
+                raise ValueError(f"Las categorías de {d} cambiaron de orden; hay que reconstruir el histograma")
+            if len(todas) > len(viejas):
+                acumulado = np.insert(acumulado, [len(viejas)] * (len(todas) - len(viejas)), 0, axis=eje)
+            categorias[d] = todas
+
+        otro = copy.copy(self)
+        otro.categorias = categorias
+        codigos, dias = otro._codigos(nuevas)
+        if len(dias):
+            # Antes del primer día el acumulado es 0; después del último se repite el total
+            antes = max(self.primer_dia - int(dias.min()), 0)
+            despues = max(int(dias.max()) - (self.primer_dia + acumulado.shape[-1] - 2), 0)
+            sin_cambio = [(0, 0)] * (acumulado.ndim - 1)
+            acumulado = np.pad(acumulado, sin_cambio + [(antes, 0)])
+            acumulado = np.pad(acumulado, sin_cambio + [(0, despues)], mode='edge')
+            otro.primer_dia = self.primer_dia - antes
+            tipo = np.int32 if int(acumulado[..., -1].sum()) + len(dias) < 2 ** 31 else np.int64
+            forma = list(acumulado.shape[:-1]) + [acumulado.shape[-1] - 1]
+            acumulado = acumulado.astype(tipo, copy=False) + otro._acumular(codigos, dias, forma, tipo)
+        otro.acumulado = acumulado
+        return otro
+
+    def _limites(self, minimo, maximo):
+        n = self.acumulado.shape[-1] - 1
+        desde = 0 if minimo is None else int(np.clip(np.ceil(minimo) - self.primer_dia, 0, n))
+        hasta = n if maximo is None else int(np.clip(np.floor(maximo) - self.primer_dia + 1, 0, n))
+        return desde, max(desde, hasta)
+
+    def _reducir(self, tabla, por, filtros):
+        # `tabla` tiene un eje por dimensión y puede tener ejes extra al final (los días).
+        # Aplica los filtros, suma las dimensiones que no están en `por` y deja los ejes de
+        # `por` en ese orden, sin el casillero de vacíos; None si un filtro no existe
+        with etapa('filtro'):
+            for eje, d in enumerate(self.dimensiones):
+                valor = filtros.get(d)
+                if valor in SIN_FILTRO:
+                    continue
+                codigo = self.categorias[d].get_indexer([valor])[0]
+                if codigo < 0:
+                    return None
+                if d in por:
+                    # Se conserva el eje para devolverlo agrupado; solo queda el valor pedido
+                    forma = [1] * tabla.ndim
+                    forma[eje] = -1
+                    tabla = tabla * (np.arange(tabla.shape[eje]) == codigo).reshape(forma)
+                else:
+                    tabla = tabla.take([codigo], axis=eje)
+
+        resto = tuple(eje for eje, d in enumerate(self.dimensiones) if d not in por)
+        tabla = tabla.sum(axis=resto, dtype=np.int64)
+
+        # Los ejes que quedan siguen el orden de self.dimensiones; se reordenan según `por`
+        quedan = [d for d in self.dimensiones if d in por]
+        extra = list(range(len(por), tabla.ndim))
+        tabla = np.transpose(tabla, [quedan.index(d) for d in por] + extra)
+        return tabla[tuple(slice(0, -1) for _ in por)]
+
+    def _indice(self, por):
+        indice = pd.MultiIndex.from_product([self.categorias[d] for d in por], names=por)
+        return indice.get_level_values(0) if len(por) == 1 else indice
+
+    @etapa('agregado')
+    def contar(self, por, filtros, minimo=None, maximo=None):
+        # Citas con minimo <= DIFERENCIA_DIAS <= maximo (ambos opcionales), agrupadas por `por`;
+        # sin `por` devuelve el total
+        por = [por] if isinstance(por, str) else list(por)
+        desde, hasta = self._limites(minimo, maximo)
+        tabla = self._reducir(self.acumulado[..., hasta] - self.acumulado[..., desde], por, filtros)
+        if tabla is None:
+            return pd.Series(dtype='int64') if por else 0
+        if not por:
+            return int(tabla)
+        serie = pd.Series(tabla.ravel(), index=self._indice(por))
+        return serie[serie > 0]
+
+    @etapa('agregado')
+    def cuantiles(self, por, filtros, cuantiles):
+        # Cuantiles de DIFERENCIA_DIAS por grupo, con la misma interpolación lineal que
+        # pandas; el valor en la posición k es el primer día cuyo acumulado supera k.
+        # `cuantiles` es {nombre: q}; sin `por` devuelve una Series con un valor por nombre
+        por = [por] if isinstance(por, str) else list(por)
+        tabla = self._reducir(self.acumulado, por, filtros)
+        if tabla is None:
+            return pd.DataFrame(columns=list(cuantiles)) if por else pd.Series(np.nan, index=list(cuantiles))
+
+        acumulado = tabla.reshape(-1, tabla.shape[-1])[:, 1:]
+        n = acumulado[:, -1]
+        resultado = {}
+        for nombre, q in cuantiles.items():
+            posicion = q * (n - 1)
+            abajo = np.floor(posicion)
+            valor_abajo = (acumulado <= abajo[:, None]).sum(axis=1)
+            valor_arriba = (acumulado <= np.ceil(posicion)[:, None]).sum(axis=1)
+            valor = self.primer_dia + valor_abajo + (posicion - abajo) * (valor_arriba - valor_abajo)
+            resultado[nombre] = np.where(n > 0, valor, np.nan)
+
+        if not por:
+            return pd.Series({nombre: valores[0] for nombre, valores in resultado.items()})
+        tabla = pd.DataFrame(resultado, index=self._indice(por))
+        return tabla[n > 0]
+
+
+# Granularidades de la línea de tiempo (períodos de pandas; las semanas van de lunes a domingo)
+GRANULARIDADES = {'D': 'D', 'W': 'W-SUN', 'M': 'M'}
+
+
+class SerieFechas(HistogramaDias):
+    # El mismo acumulado, sobre la fecha de solicitud. Por cada combinación de filtros se
+    # reduce una sola vez a un vector acumulado por día; de ahí sale la serie diaria,
+    # semanal o mensual de cualquier ventana restando el acumulado en los bordes de período
+
+    def __init__(self, df, dimensiones, columna='DIA_SOLICITACITA'):
+        super().__init__(df, dimensiones, columna)
+        self._preparar_periodos()
+
+    def con_filas(self, df, desde):
+        otro = super().con_filas(df, desde)
+        otro._preparar_periodos()
+        return otro
+
+    def _preparar_periodos(self):
+        n = self.acumulado.shape[-1] - 1
+        dias = pd.date_range(self.fecha(0), periods=n, freq='D')
+        self.inicios = {}
+        self.fechas = {}
+        for granularidad, frecuencia in GRANULARIDADES.items():
+            periodos = dias.to_period(frecuencia)
+            codigos = periodos.asi8
+            self.inicios[granularidad] = np.flatnonzero(np.r_[True, codigos[1:] != codigos[:-1]])
+            self.fechas[granularidad] = periodos[self.inicios[granularidad]].start_time
+        self._por_filtros = {}
+
+    def fecha(self, posicion):
+        return pd.Timestamp(self.primer_dia + int(posicion), unit='D')
+
+    def posicion(self, fecha):
+        return (pd.Timestamp(fecha).normalize() - pd.Timestamp(0)).days - self.primer_dia
+
+    def acumulado_total(self, filtros):
+        clave = tuple((d, filtros.get(d)) for d in self.dimensiones)
+        if clave not in self._por_filtros:
+            tabla = self._reducir(self.acumulado, [], filtros)
+            self._por_filtros[clave] = np.zeros(self.acumulado.shape[-1], dtype=np.int64) if tabla is None else tabla
+        return self._por_filtros[clave]
+
+    @etapa('agregado')
+    def serie(self, filtros, granularidad='M', desde=None, hasta=None):
+        # Citas por período (índice: primer día del período); con desde/hasta solo los
+        # períodos que tocan esa ventana
+        acumulado = self.acumulado_total(filtros)
+        inicios = self.inicios[granularidad]
+        bordes = np.r_[inicios, len(acumulado) - 1]
+        primero = 0 if desde is None else max(np.searchsorted(inicios, self.posicion(desde), side='right') - 1, 0)
+        ultimo = len(inicios) if hasta is None else np.searchsorted(inicios, self.posicion(hasta), side='right')
+        conteos = acumulado[bordes[primero + 1:ultimo + 1]] - acumulado[bordes[primero:ultimo]]
+        return pd.Series(conteos, index=self.fechas[granularidad][primero:ultimo])
+
+    @etapa('agregado')
+    def por_periodo(self, por, filtros, granularidad='M'):
+        # Citas de cada período (filas: primer día) por valor de `por` (columnas), de una vez
+        # para todos los períodos; no incluye las citas con `por` vacío
+        tabla = self._reducir(self.acumulado, [por], filtros)
+        if tabla is None:
+            return pd.DataFrame(columns=self.categorias[por], dtype='int64')
+        bordes = np.r_[self.inicios[granularidad], self.acumulado.shape[-1] - 1]
+        return pd.DataFrame((tabla[:, bordes[1:]] - tabla[:, bordes[:-1]]).T,
+                            index=self.fechas[granularidad], columns=self.categorias[por])
+
+    def periodo(self, fecha, granularidad):
+        # Primer y último día (en días desde 1970) del período que contiene `fecha`
+        periodo = pd.Timestamp(fecha).to_period(GRANULARIDADES[granularidad])
+        inicio = (periodo.start_time - pd.Timestamp(0)).days
+        return inicio, inicio + (periodo.end_time.normalize() - periodo.start_time).days
+
+
+def lttb(x, y, puntos):
+    # Largest-Triangle-Three-Buckets: devuelve las posiciones de `puntos` muestras que
+    # conservan la forma de la serie (siempre incluye la primera y la última)
+    n = len(x)
+    if puntos >= n or puntos < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype='float64')
+    y = np.asarray(y, dtype='float64')
+    bordes = np.linspace(1, n - 1, puntos - 1).astype(np.int64)
+    elegidos = [0]
+    for i in range(puntos - 2):
+        inicio, fin = bordes[i], bordes[i + 1]
+        siguiente = slice(fin, bordes[i + 2] if i + 2 < len(bordes) else n)
+        x_prom, y_prom = x[siguiente].mean(), y[siguiente].mean()
+        a = elegidos[-1]
+        areas = np.abs((x[a] - x_prom) * (y[inicio:fin] - y[a]) - (x[a] - x[inicio:fin]) * (y_prom - y[a]))
+        elegidos.append(inicio + int(np.argmax(areas)))
+    elegidos.append(n - 1)
+    return np.array(elegidos)
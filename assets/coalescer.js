@@ -0,0 +1,18 @@
+// Numera las peticiones de callbacks de esta pestaña para que el servidor descarte las que
+// quedaron superadas por otra más nueva de la misma salida (coalescer.py). Se engancha como
+// request_pre del renderer (multi_app.app.renderer)
+(function () {
+    // Una sesión por carga de página, no por pestaña: al recargar el contador vuelve a 0 y
+    // una sesión guardada heredaría los números altos que el servidor ya vio
+    var sesion = Math.random().toString(36).slice(2) + Date.now().toString(36);
+    var n = 0;
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        coalescer: {
+            numerar: function (payload) {
+                n += 1;
+                payload.secuencia = {sesion: sesion, n: n};
+            }
+        }
+    });
+})();
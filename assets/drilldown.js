@@ -0,0 +1,178 @@
+// Drill-downs en el navegador. Los callbacks principales dejan en un dcc.Store los conteos
+// cruzados del estado de filtros actual (multi_app.cruce_conteos, cruce_medias y
+// cruce_tiempo); un clic solo recalcula desde ahí y no genera pedidos al servidor
+(function () {
+    var sinCambios = function () { return window.dash_clientside.no_update; };
+
+    // Las n categorías con más citas y el resto sumado en "Otras"; en los empates queda
+    // primero la de menor orden de categoría. `total` permite que "Otras" incluya citas
+    // sin categoría
+    function topConOtras(columnas, valores, n, total) {
+        var pares = [];
+        var suma = 0;
+        for (var i = 0; i < columnas.length; i++) {
+            if (valores[i] > 0) {
+                pares.push([columnas[i], valores[i]]);
+                suma += valores[i];
+            }
+        }
+        pares.sort(function (a, b) { return b[1] - a[1]; });
+        var top = pares.slice(0, n);
+        var otras = total === undefined ? suma : total;
+        top.forEach(function (par) { otras -= par[1]; });
+        if (otras > 0) {
+            top.push(['Otras', otras]);
+        }
+        return top;
+    }
+
+    function conTitulo(figura, titulo) {
+        return Object.assign({}, figura.layout, {title: Object.assign({}, figura.layout.title, {text: titulo})});
+    }
+
+    function conPie(figura, pares, titulo, alto) {
+        var traza = Object.assign({}, figura.data[0], {
+            labels: pares.map(function (par) { return par[0]; }),
+            values: pares.map(function (par) { return par[1]; })
+        });
+        var layout = conTitulo(figura, titulo);
+        if (alto !== undefined) {
+            layout.height = alto;
+        }
+        return Object.assign({}, figura, {data: [traza].concat(figura.data.slice(1)), layout: layout});
+    }
+
+    function conBarras(figura, pares, titulo) {
+        var traza = Object.assign({}, figura.data[0], {
+            x: pares.map(function (par) { return par[0]; }),
+            y: pares.map(function (par) { return par[1]; })
+        });
+        return Object.assign({}, figura, {data: [traza].concat(figura.data.slice(1)), layout: conTitulo(figura, titulo)});
+    }
+
+    // Top de especialidades del tramo clicado en un histograma
+    function pieTramo(clickData, cruce, figura, titulo) {
+        if (!clickData) {
+            return conPie(figura, [], 'Haga clic en una barra del histograma', 500);
+        }
+        if (!cruce) {
+            return sinCambios();
+        }
+        var tramo = clickData.points[0].x;
+        var fila = cruce.filas[tramo];
+        var top = fila ? topConOtras(cruce.columnas, fila, cruce.n) : [];
+        var total = top.reduce(function (suma, par) { return suma + par[1]; }, 0);
+        if (total > 0) {
+            return conPie(figura, top, titulo(cruce.n, tramo, total), 600);
+        }
+        return conPie(figura, [], 'No hay datos para mostrar', 500);
+    }
+
+    // Espera promedio por valor del desglose para el sector clicado de un pastel
+    function mediasSector(clickData, cruce, figura, vacio, titulo, ordenar) {
+        if (!clickData) {
+            return conBarras(figura, [], vacio);
+        }
+        if (!cruce) {
+            return sinCambios();
+        }
+        var sector = clickData.points[0].label;
+        var fila = cruce.filas[sector] || {n: [], suma: []};
+        var pares = [];
+        for (var i = 0; i < fila.n.length; i++) {
+            if (fila.n[i] > 0) {
+                pares.push([cruce.columnas[i], fila.suma[i] / fila.n[i]]);
+            }
+        }
+        if (ordenar) {
+            pares.sort(function (a, b) { return b[1] - a[1]; });
+        }
+        return conBarras(figura, pares, titulo + ' - ' + sector);
+    }
+
+    // Primer día (AAAA-MM-DD) del período que contiene `fecha`; las semanas van de lunes a domingo
+    function inicioPeriodo(fecha, granularidad) {
+        if (granularidad === 'M') {
+            return fecha.slice(0, 7) + '-01';
+        }
+        if (granularidad === 'W') {
+            var dia = new Date(fecha + 'T00:00:00Z');
+            dia.setUTCDate(dia.getUTCDate() - (dia.getUTCDay() + 6) % 7);
+            return dia.toISOString().slice(0, 10);
+        }
+        return fecha;
+    }
+
+    function etiquetaPeriodo(inicio, granularidad) {
+        if (granularidad === 'M') {
+            return inicio.slice(0, 7);
+        }
+        if (granularidad === 'W') {
+            return 'Semana del ' + inicio;
+        }
+        return inicio;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        drilldown: {
+            pieEdad: function (clickData, cruce, figura) {
+                return pieTramo(clickData, cruce, figura, function (n, tramo, total) {
+                    return 'Top ' + n + ' Especialidades - ' + tramo + ' (' + total + ' pacientes)';
+                });
+            },
+
+            pieEspera: function (clickData, cruce, figura) {
+                return pieTramo(clickData, cruce, figura, function (n, tramo, total) {
+                    return 'Top ' + n + ' Especialidades - Espera ' + tramo + ' días (' + total + ' pacientes)';
+                });
+            },
+
+            barrasModalidad: function (clickData, cruce, figura) {
+                return mediasSector(clickData, cruce, figura, 'Seleccione una modalidad en el gráfico de pastel',
+                                    'Tiempo Promedio de Espera por Especialidad', true);
+            },
+
+            barrasSeguro: function (clickData, cruce, figura) {
+                return mediasSector(clickData, cruce, figura, 'Seleccione un estado en el gráfico de pastel',
+                                    'Tiempo Promedio de Espera por Sexo', false);
+            },
+
+            piesTiempo: function (clickData, cruce, figuraEspecialidades, figuraAtencion) {
+                if (!clickData) {
+                    var vacio = 'Seleccione un período en la línea de tiempo';
+                    return [conPie(figuraEspecialidades, [], vacio), conPie(figuraAtencion, [], vacio)];
+                }
+                if (!cruce) {
+                    return [sinCambios(), sinCambios()];
+                }
+                // Con eje de fechas plotly puede devolver '2023-02' o '2023-02-01 00:00'
+                var fecha = String(clickData.points[0].x).slice(0, 10);
+                if (fecha.length === 7) {
+                    fecha += '-01';
+                }
+                var inicio = inicioPeriodo(fecha, cruce.granularidad);
+                var periodo = cruce.periodos[inicio];
+                if (!periodo) {
+                    var sinDatos = 'No hay datos para este período';
+                    return [conPie(figuraEspecialidades, [], sinDatos), conPie(figuraAtencion, [], sinDatos)];
+                }
+                var etiqueta = etiquetaPeriodo(inicio, cruce.granularidad);
+                var top = topConOtras(
+                    periodo.especialidades.map(function (par) { return cruce.especialidades[par[0]]; }),
+                    periodo.especialidades.map(function (par) { return par[1]; }),
+                    cruce.n, periodo.total);
+                var atencion = [];
+                cruce.atencion.forEach(function (estado, i) {
+                    if (periodo.atencion[i] > 0) {
+                        atencion.push([estado, periodo.atencion[i]]);
+                    }
+                });
+                return [
+                    conPie(figuraEspecialidades, top,
+                           'Top ' + cruce.n + ' Especialidades - ' + etiqueta + ' (' + periodo.total + ' citas)'),
+                    conPie(figuraAtencion, atencion, 'Estado de Atención - ' + etiqueta)
+                ];
+            }
+        }
+    });
+})();
@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generar_citas import filas_de
+from medir_callbacks import DIR_BENCH, RAIZ, entorno_datos
+
+# Prueba de carga sin red: levanta gunicorn con multi_app:server sobre citas sintéticas y
+# simula usuarios que recorren los tableros como lo haría el navegador. Cada sesión abre
+# una página (HTML, layout, dependencias, contenido de la página y callbacks iniciales),
+# cambia dropdowns, arrastra sliders y hace zoom en la línea de tiempo. Los clics de
+# drill-down se resuelven en el navegador y no generan tráfico. Se repite para cada
+# configuración de workers x threads y se informa throughput, latencias y errores por endpoint.
+#
+#   python benchmarks/carga_http.py --filas 1m --configuraciones 1x1 2x1 2x4 --usuarios 20 --duracion 60
+
+PAGINAS = ['/edad/', '/espera/', '/modalidad/', '/asegurados/', '/tiempo/']
+# Ventana de zoom de la línea de tiempo, dentro del rango de fechas de generar_citas
+ZOOM = {'xaxis.range[0]': '2023-03-01', 'xaxis.range[1]': '2023-08-31'}
+
+
+class Registro:
+    # Resultados de todas las peticiones de una corrida, de todos los usuarios
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filas = []
+
+    def anotar(self, endpoint, estado, segundos):
+        with self.lock:
+            self.filas.append((endpoint, estado, segundos))
+
+    def resumen(self, duracion):
+        por_endpoint = {}
+        for endpoint, estado, segundos in self.filas:
+            por_endpoint.setdefault(endpoint, []).append((estado, segundos))
+        resultado = {}
+        for endpoint, filas in sorted(por_endpoint.items()):
+            tiempos = np.array([segundos for _, segundos in filas]) * 1000
+            errores = sum(1 for estado, _ in filas if estado is None or estado >= 400)
+            resultado[endpoint] = {
+                'peticiones': len(filas),
+                'por_seg': round(len(filas) / duracion, 2),
+                'p50_ms': round(float(np.percentile(tiempos, 50)), 1),
+                'p95_ms': round(float(np.percentile(tiempos, 95)), 1),
+                'p99_ms': round(float(np.percentile(tiempos, 99)), 1),
+                'errores': round(errores / len(filas), 4),
+                # 204: petición descartada porque otra más nueva la reemplazó
+                'descartadas': sum(1 for estado, _ in filas if estado == 204),
+            }
+        return resultado
+
+
+class Usuario:
+    def __init__(self, base, registro, rng, arrastre_seg, pausa_seg):
+        self.base = base
+        self.registro = registro
+        self.rng = rng
+        self.arrastre_seg = arrastre_seg
+        self.pausa_seg = pausa_seg
+        # Igual que assets/coalescer.js: un id por pestaña y un número por petición
+        self.sesion = f'carga-{rng.getrandbits(48):x}'
+        self.lock = threading.Lock()
+        self.n = 0
+
+    def pedir(self, endpoint, ruta, cuerpo=None):
+        datos = None
+        cabeceras = {}
+        if cuerpo is not None:
+            with self.lock:
+                self.n += 1
+                cuerpo['secuencia'] = {'sesion': self.sesion, 'n': self.n}
+            datos = json.dumps(cuerpo).encode()
+            cabeceras['Content-Type'] = 'application/json'
+        peticion = urllib.request.Request(self.base + ruta, data=datos, headers=cabeceras)
+        inicio = time.perf_counter()
+        estado, contenido = None, b''
+        try:
+            with urllib.request.urlopen(peticion, timeout=60) as respuesta:
+                estado, contenido = respuesta.status, respuesta.read()
+        except urllib.error.HTTPError as error:
+            estado = error.code
+        except OSError:
+            pass
+        self.registro.anotar(endpoint, estado, time.perf_counter() - inicio)
+        return estado, contenido
+
+    def callback(self, dependencia, valores, cambiado):
+        salidas = dependencia['output'].strip('.').split('...')
+        outputs = [dict(zip(('id', 'property'), salida.split('@')[0].rsplit('.', 1))) for salida in salidas]
+        cuerpo = {
+            'output': dependencia['output'],
+            # Con una sola salida el navegador manda el objeto y no una lista
+            'outputs': outputs if dependencia['output'].startswith('..') else outputs[0],
+            'inputs': [dict(entrada, value=valores.get((entrada['id'], entrada['property'])))
+                       for entrada in dependencia['inputs']],
+            'state': [dict(estado, value=valores.get((estado['id'], estado['property'])))
+                      for estado in dependencia['state']],
+            'changedPropIds': [f'{cambiado[0]}.{cambiado[1]}'] if cambiado else [],
+        }
+        endpoint = 'POST ' + salidas[0].split('.')[0] + (' (zoom)' if '@' in salidas[0] else '')
+        estado, contenido = self.pedir(endpoint, '/_dash-update-component', cuerpo)
+        return json.loads(contenido) if estado == 200 else None
+
+    def pausa(self):
+        time.sleep(self.rng.expovariate(1 / self.pausa_seg) if self.pausa_seg else 0)
+
+    def sesion_pagina(self, ruta, dependencias):
+        self.pedir(f'GET {ruta}', ruta)
+        self.pedir('GET /_dash-layout', '/_dash-layout')
+        self.pedir('GET /_dash-dependencies', '/_dash-dependencies')
+        paginas = next(d for d in dependencias if '_pages_content.children' in d['output'])
+        respuesta = self.callback(paginas, {('_pages_location', 'pathname'): ruta,
+                                            ('_pages_location', 'search'): ''}, ('_pages_location', 'pathname'))
+        if respuesta is None:
+            return
+        componentes = {}
+        recorrer(respuesta['response']['_pages_content']['children'], componentes)
+        valores = {(id_, prop): valor for id_, c in componentes.items() for prop, valor in c['props'].items()}
+        propias = [d for d in dependencias if not d.get('clientside_function')
+                   and all(e['id'] in componentes for e in d['inputs'])]
+
+        # Callbacks iniciales, como al montar la página
+        for dependencia in propias:
+            if not dependencia.get('prevent_initial_call'):
+                self.callback(dependencia, valores, None)
+
+        acciones = []
+        for id_, componente in componentes.items():
+            if componente['type'] in ('Dropdown', 'RadioItems'):
+                acciones.append(('opcion', id_))
+            elif componente['type'] in ('Slider', 'RangeSlider'):
+                acciones.append(('slider', id_))
+        acciones += [('zoom', e['id']) for d in propias for e in d['inputs'] if e['property'] == 'relayoutData']
+        self.rng.shuffle(acciones)
+
+        for tipo, id_ in acciones:
+            self.pausa()
+            if tipo == 'opcion':
+                opciones = [o['value'] for o in componentes[id_]['props'].get('options', [])]
+                valores[(id_, 'value')] = self.rng.choice(opciones)
+                self.disparar(propias, valores, (id_, 'value'))
+            elif tipo == 'slider':
+                self.arrastrar(propias, valores, id_, componentes[id_]['props'])
+            else:
+                for ventana in (ZOOM, {'xaxis.autorange': True}):
+                    valores[(id_, 'relayoutData')] = ventana
+                    self.disparar(propias, valores, (id_, 'relayoutData'))
+
+    def disparar(self, dependencias, valores, cambiado):
+        for dependencia in dependencias:
+            if any((e['id'], e['property']) == cambiado for e in dependencia['inputs']):
+                self.callback(dependencia, valores, cambiado)
+
+    def arrastrar(self, dependencias, valores, id_, props):
+        # Con updatemode='drag' el navegador manda un valor cada tanto sin esperar la
+        # respuesta anterior; acá cada paso sale en su propio hilo
+        minimo, maximo = float(props['min']), float(props['max'])
+        destino = self.rng.uniform(minimo, maximo)
+        actual = valores[(id_, 'value')]
+        inicio = actual[-1] if isinstance(actual, list) else actual
+        hilos = []
+        for paso in np.linspace(inicio, destino, 6)[1:]:
+            paso = int(round(paso))
+            valor = [actual[0], max(paso, actual[0])] if isinstance(actual, list) else paso
+            instantanea = dict(valores)
+            instantanea[(id_, 'value')] = valor
+            hilo = threading.Thread(target=self.disparar, args=(dependencias, instantanea, (id_, 'value')))
+            hilo.start()
+            hilos.append(hilo)
+            time.sleep(self.arrastre_seg)
+        for hilo in hilos:
+            hilo.join()
+        valores[(id_, 'value')] = valor
+
+
+def recorrer(nodo, componentes):
+    # id -> componente de todo el árbol de la página
+    if isinstance(nodo, list):
+        for hijo in nodo:
+            recorrer(hijo, componentes)
+    elif isinstance(nodo, dict) and 'props' in nodo:
+        if 'id' in nodo['props']:
+            componentes[nodo['props']['id']] = nodo
+        for valor in nodo['props'].values():
+            recorrer(valor, componentes)
+
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def esperar_listo(base, proceso, limite_seg):
+    limite = time.time() + limite_seg
+    while time.time() < limite:
+        if proceso.poll() is not None:
+            raise RuntimeError('gunicorn terminó antes de quedar listo')
+        try:
+            with urllib.request.urlopen(base + '/healthz', timeout=5) as respuesta:
+                if respuesta.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f'gunicorn no respondió /healthz en {limite_seg} s')
+
+
+def correr_configuracion(workers, threads, entorno, argumentos):
+    puerto = puerto_libre()
+    base = f'http://127.0.0.1:{puerto}'
+    cache = os.path.join(DIR_BENCH, f'cache_carga_{workers}x{threads}')
+    # Cache de figuras vacío en cada configuración: todas parten del mismo precalentamiento
+    shutil.rmtree(cache, ignore_errors=True)
+    entorno = dict(entorno, CACHE_FIGURAS_DIR=cache, PRECALENTAR='1')
+    with open(os.path.join(DIR_BENCH, f'gunicorn_{workers}x{threads}.log'), 'w') as log:
+        proceso = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--workers', str(workers),
+             '--threads', str(threads), '--bind', f'127.0.0.1:{puerto}', 'multi_app:server'],
+            cwd=RAIZ, env=entorno, stdout=log, stderr=log)
+        try:
+            esperar_listo(base, proceso, argumentos.espera_arranque)
+            with urllib.request.urlopen(base + '/_dash-dependencies') as respuesta:
+                dependencias = json.loads(respuesta.read())
+            registro = Registro()
+            fin = time.time() + argumentos.duracion
+
+            def usuario(i):
+                rng = random.Random(argumentos.semilla * 1000 + i)
+                simulado = Usuario(base, registro, rng, argumentos.arrastre_ms / 1000, argumentos.pausa_ms / 1000)
+                while time.time() < fin:
+                    simulado.sesion_pagina(rng.choice(PAGINAS), dependencias)
+
+            inicio = time.perf_counter()
+            hilos = [threading.Thread(target=usuario, args=(i,)) for i in range(argumentos.usuarios)]
+            for hilo in hilos:
+                hilo.start()
+            for hilo in hilos:
+                hilo.join()
+            duracion = time.perf_counter() - inicio
+        finally:
+            proceso.terminate()
+            proceso.wait(timeout=30)
+    endpoints = registro.resumen(duracion)
+    return {
+        'workers': workers,
+        'threads': threads,
+        'duracion_seg': round(duracion, 1),
+        'peticiones': len(registro.filas),
+        'por_seg': round(len(registro.filas) / duracion, 2),
+        'endpoints': endpoints,
+    }
+
+
+def imprimir(resultado):
+    print(f"\n{resultado['workers']} workers x {resultado['threads']} threads: {resultado['peticiones']} peticiones "
+          f"en {resultado['duracion_seg']} s, {resultado['por_seg']} por segundo")
+    print(f"{'endpoint':<38}{'n':>7}{'/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errores':>9}{'204':>6}")
+    for endpoint, valores in resultado['endpoints'].items():
+        print(f"{endpoint:<38}{valores['peticiones']:>7}{valores['por_seg']:>8}{valores['p50_ms']:>9}"
+              f"{valores['p95_ms']:>9}{valores['p99_ms']:>9}{valores['errores']:>9.1%}{valores['descartadas']:>6}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga de multi_app:server bajo gunicorn')
+    parser.add_argument('--filas', default='100k', help='citas sintéticas: 10k, 100k, 1m, 10m o un número')
+    parser.add_argument('--filas-lote', type=int, default=0, help='DATOS_FILAS_LOTE para la carga')
+    parser.add_argument('--configuraciones', nargs='+', default=['1x1', '2x1', '2x4'],
+                        help='workers x threads de cada corrida')
+    parser.add_argument('--usuarios', type=int, default=10, help='usuarios simultáneos')
+    parser.add_argument('--duracion', type=float, default=30, help='segundos de carga por configuración')
+    parser.add_argument('--pausa-ms', type=float, default=500, help='pausa media entre acciones de un usuario')
+    parser.add_argument('--arrastre-ms', type=float, default=50, help='intervalo entre pasos de un arrastre')
+    parser.add_argument('--espera-arranque', type=float, default=300, help='segundos máximos hasta /healthz 200')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--guardar', help='JSON donde guardar los resultados')
+    argumentos = parser.parse_args()
+
+    entorno = entorno_datos(filas_de(argumentos.filas), argumentos.semilla, argumentos.filas_lote)
+    resultados = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'filas': filas_de(argumentos.filas),
+        'usuarios': argumentos.usuarios,
+        'configuraciones': [],
+    }
+    for configuracion in argumentos.configuraciones:
+        workers, threads = (int(x) for x in configuracion.lower().split('x'))
+        resultado = correr_configuracion(workers, threads, entorno, argumentos)
+        imprimir(resultado)
+        resultados['configuraciones'].append(resultado)
+
+    if argumentos.guardar:
+        os.makedirs(os.path.dirname(argumentos.guardar) or '.', exist_ok=True)
+        with open(argumentos.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
@@ -0,0 +1,104 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Citas sintéticas con las mismas columnas que el CSV de origen, para medir los tableros a
+# 10k, 100k, 1M y 10M filas sin depender de Google Drive. Las cardinalidades y el sesgo
+# imitan a los datos reales: pocas especialidades concentran la mayoría de las citas, la
+# espera depende de la especialidad y hay vacíos en EDAD y SEGURO.
+#
+#   python benchmarks/generar_citas.py 1m data/bench/citas_1m.csv
+
+ESPECIALIDADES = [
+    'MEDICINA INTERNA', 'PEDIATRIA', 'GINECOLOGIA', 'OBSTETRICIA', 'CARDIOLOGIA', 'OFTALMOLOGIA',
+    'TRAUMATOLOGIA', 'DERMATOLOGIA', 'OTORRINOLARINGOLOGIA', 'ODONTOLOGIA', 'PSICOLOGIA', 'NEUROLOGIA',
+    'ENDOCRINOLOGIA', 'GASTROENTEROLOGIA', 'MEDICINA FISICA Y REHABILITACION', 'CIRUGIA GENERAL',
+    'UROLOGIA', 'NEUMOLOGIA', 'PSIQUIATRIA', 'NUTRICION', 'REUMATOLOGIA', 'NEFROLOGIA', 'MEDICINA FAMILIAR',
+    'GERIATRIA', 'ONCOLOGIA', 'HEMATOLOGIA', 'INFECTOLOGIA', 'NEUROCIRUGIA', 'ALERGIA E INMUNOLOGIA',
+    'CIRUGIA PEDIATRICA', 'NEONATOLOGIA', 'CARDIOLOGIA PEDIATRICA', 'NEUROLOGIA PEDIATRICA',
+    'CIRUGIA PLASTICA', 'CIRUGIA DE CABEZA Y CUELLO', 'ANESTESIOLOGIA', 'CIRUGIA CARDIOVASCULAR',
+    'CIRUGIA DE TORAX', 'MEDICINA DEL DOLOR', 'GENETICA',
+]
+PEDIATRICAS = {'PEDIATRIA', 'CIRUGIA PEDIATRICA', 'NEONATOLOGIA', 'CARDIOLOGIA PEDIATRICA',
+               'NEUROLOGIA PEDIATRICA'}
+SALUD_MENTAL = {'PSICOLOGIA', 'PSIQUIATRIA'}
+
+DESDE = pd.Timestamp('2022-01-01')
+HASTA = pd.Timestamp('2024-12-31')
+FILAS_POR_BLOQUE = 1_000_000
+
+
+def filas_de(texto):
+    # '10k', '1m', '10M' o un número
+    texto = texto.strip().lower()
+    multiplicador = {'k': 10 ** 3, 'm': 10 ** 6}.get(texto[-1])
+    if multiplicador:
+        return int(float(texto[:-1]) * multiplicador)
+    return int(texto)
+
+
+def perfil_especialidades(rng):
+    # Frecuencia tipo Zipf por orden de la lista y una espera media propia de cada especialidad
+    frecuencia = 1 / np.arange(1, len(ESPECIALIDADES) + 1) ** 1.1
+    espera_media = rng.uniform(5, 60, len(ESPECIALIDADES))
+    return frecuencia / frecuencia.sum(), espera_media
+
+
+def dias_solicitud(rng):
+    # Los días hábiles pesan más que los fines de semana y la demanda crece con el tiempo
+    dias = pd.date_range(DESDE, HASTA, freq='D')
+    peso = np.where(dias.dayofweek < 5, 1.0, 0.15) * np.linspace(0.7, 1.3, len(dias))
+    return dias.strftime('%Y-%m-%d').to_numpy(), peso / peso.sum()
+
+
+def bloque(rng, n, probabilidades, espera_media, dias, peso_dias):
+    indice = rng.choice(len(ESPECIALIDADES), n, p=probabilidades)
+    especialidad = np.asarray(ESPECIALIDADES, dtype=object)[indice]
+    pediatrica = np.isin(especialidad, list(PEDIATRICAS))
+
+    edad = np.where(pediatrica, rng.integers(0, 18, n),
+                    np.clip(rng.normal(45, 20, n), 18, 100)).round().astype(float)
+    edad[rng.random(n) < 0.005] = np.nan
+
+    remoto = rng.random(n) < np.where(np.isin(especialidad, list(SALUD_MENTAL)), 0.45, 0.12)
+    seguro = rng.choice(np.array(['SIS', 'NINGUNO', None], dtype=object), n, p=[0.68, 0.29, 0.03])
+    dias_espera = rng.gamma(2.0, espera_media[indice] / 2.0).round().astype(int)
+
+    return pd.DataFrame({
+        'ESPECIALIDAD': especialidad,
+        'SEXO': rng.choice(np.array(['FEMENINO', 'MASCULINO'], dtype=object), n, p=[0.58, 0.42]),
+        'EDAD': pd.array(edad, dtype='Int64'),
+        'PRESENCIAL_REMOTO': np.where(remoto, 'REMOTO', 'PRESENCIAL'),
+        'ATENDIDO': np.where(rng.random(n) < 0.88, 'SI', 'NO'),
+        'SEGURO': seguro,
+        'DIA_SOLICITACITA': rng.choice(dias, n, p=peso_dias),
+        'DIFERENCIA_DIAS': dias_espera,
+    })
+
+
+def generar(filas, ruta, semilla=0):
+    # Se escribe por bloques: 10M filas no necesitan 10M filas en memoria
+    rng = np.random.default_rng(semilla)
+    probabilidades, espera_media = perfil_especialidades(rng)
+    dias, peso_dias = dias_solicitud(rng)
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    escritas = 0
+    while escritas < filas:
+        n = min(FILAS_POR_BLOQUE, filas - escritas)
+        bloque(rng, n, probabilidades, espera_media, dias, peso_dias).to_csv(
+            temporal, mode='a' if escritas else 'w', header=not escritas, index=False)
+        escritas += n
+    os.replace(temporal, ruta)
+    return ruta
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Genera citas sintéticas con el esquema del CSV de origen')
+    parser.add_argument('filas', help="cantidad de filas: 10k, 100k, 1m, 10m o un número")
+    parser.add_argument('ruta', help='CSV de salida')
+    parser.add_argument('--semilla', type=int, default=0)
+    argumentos = parser.parse_args()
+    generar(filas_de(argumentos.filas), argumentos.ruta, argumentos.semilla)
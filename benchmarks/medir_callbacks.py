@@ -0,0 +1,228 @@
+import argparse
+import inspect
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generar_citas import filas_de, generar
+
+# Latencia, memoria pico y bytes enviados de cada update_*_charts sobre datos sintéticos.
+# Cada tamaño corre en un proceso aparte (multi_app carga los datos al importarse) y los
+# callbacks se llaman sin el cache de figuras. Los drill-downs se resuelven en el navegador
+# desde el cruce que devuelve cada callback, así que su costo está en los bytes medidos.
+#
+#   python benchmarks/medir_callbacks.py 10k 100k 1m --guardar mi_base.json
+#   python benchmarks/medir_callbacks.py 10k 100k 1m --comparar mi_base.json
+#
+# Con --comparar termina con código 1 si algo empeoró más que --tolerancia. Los tiempos
+# dependen de la máquina: si la línea base es de otra (como benchmarks/resultados/base.json,
+# de referencia) solo se muestran las diferencias
+
+DIR_BENCH = os.path.join(RAIZ, 'data', 'bench')
+
+
+def matriz_entradas(d, nombre, valores, especialidades):
+    # Producto de las alternativas de cada filtro, partiendo del estado inicial del tablero
+    from datos import RANGOS_EDAD
+    alternativas = {
+        'especialidad': ['Todas'] + especialidades,
+        'sexo': ['Todos'] + list(d.valores['SEXO']),
+        'modalidad': ['Todas'] + list(d.valores['PRESENCIAL_REMOTO']),
+        'atencion': ['Todos'] + list(d.valores['ATENDIDO']),
+        'estado': ['Todos'] + list(d.valores['ATENDIDO']),
+        'dias_range': [valores.get('dias_range'), [0, 30], [10, 60]],
+        'umbral': [10, 30, 90],
+        'granularidad': ['M', 'W', 'D'],
+    }
+    if nombre == 'espera':
+        alternativas['edad'] = ['Todos'] + RANGOS_EDAD['etiquetas']
+    else:
+        alternativas['edad'] = ['Todos'] + RANGOS_EDAD['etiquetas'][::2]
+    parametros = list(valores)
+    for combinacion in itertools.product(*[alternativas.get(p, [valores[p]]) for p in parametros]):
+        yield dict(zip(parametros, combinacion))
+
+
+def percentil(tiempos, q):
+    return round(float(np.percentile(tiempos, q)) * 1000, 3)
+
+
+def medir(repeticiones, n_especialidades):
+    # Corre dentro del proceso hijo, con DATOS_* apuntando al CSV sintético
+    inicio = time.perf_counter()
+    import multi_app
+    from cache_figuras import a_json
+    from plotly.io.json import to_json_plotly
+    carga = time.perf_counter() - inicio
+
+    resultados = {
+        'filas': None,
+        'carga_seg': round(carga, 3),
+        'rss_carga_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'callbacks': {},
+    }
+    with multi_app.server.app_context():
+        d = multi_app.conjunto.actual()
+        resultados['filas'] = int(d.filas)
+        frecuencia = d.cubo.contar('ESPECIALIDAD', {}).sort_values(ascending=False)
+        # Las más frecuentes y la menos frecuente (cola larga)
+        especialidades = list(frecuencia.index[:max(n_especialidades - 1, 0)]) + list(frecuencia.index[-1:])
+        for nombre, (funciones, valores) in multi_app.vistas_iniciales(d).items():
+            # Sin el cache de figuras ni las métricas
+            funcion = inspect.unwrap(funciones[0])
+            entradas = [[combinacion[p] for p in valores] for combinacion in
+                        matriz_entradas(d, nombre, valores, especialidades)]
+            tiempos, picos, tamanos = [], [], []
+            for argumentos in entradas:
+                # Primero sin tracemalloc, que agrega su propio costo a la latencia
+                for _ in range(repeticiones):
+                    inicio = time.perf_counter()
+                    salida = funcion(*argumentos)
+                    tiempos.append(time.perf_counter() - inicio)
+                tamanos.append(len(to_json_plotly(a_json(salida))))
+                tracemalloc.start()
+                funcion(*argumentos)
+                picos.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            resultados['callbacks'][nombre] = {
+                'combinaciones': len(entradas),
+                'llamadas': len(tiempos),
+                'p50_ms': percentil(tiempos, 50),
+                'p90_ms': percentil(tiempos, 90),
+                'p99_ms': percentil(tiempos, 99),
+                'max_ms': percentil(tiempos, 100),
+                'pico_mb': round(max(picos) / 2 ** 20, 2),
+                'bytes_p50': int(np.percentile(tamanos, 50)),
+                'bytes_max': int(max(tamanos)),
+            }
+    resultados['rss_max_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    return resultados
+
+
+def entorno_datos(filas, semilla=0, filas_lote=0):
+    # Variables de entorno para que multi_app cargue `filas` citas sintéticas; el CSV y el
+    # snapshot se arman si faltan, así la carga que se mide es la de un arranque normal
+    nombre = f'citas_{filas}'
+    csv = os.path.join(DIR_BENCH, f'{nombre}.csv')
+    if not os.path.exists(csv):
+        print(f'Generando {csv}', file=sys.stderr)
+        generar(filas, csv, semilla)
+    entorno = dict(
+        os.environ,
+        DATOS_CSV=csv,
+        DATOS_SNAPSHOT_DIR=os.path.join(DIR_BENCH, nombre),
+        DATOS_FILAS_LOTE=str(filas_lote),
+        DATOS_REFRESCO_SEG='0',
+        PRECALENTAR='0',
+        CACHE_FIGURAS_DIR=os.path.join(DIR_BENCH, 'cache_figuras'),
+    )
+    entorno.pop('GUNICORN_PRECARGA', None)
+    subprocess.run([sys.executable, '-c', 'import conjunto; conjunto.iniciar()'],
+                   cwd=RAIZ, env=entorno, check=True, stdout=subprocess.DEVNULL)
+    return entorno
+
+
+def correr_tamano(filas, argumentos):
+    entorno = entorno_datos(filas, argumentos.semilla, argumentos.filas_lote)
+    proceso = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--hijo',
+         '--repeticiones', str(argumentos.repeticiones), '--especialidades', str(argumentos.especialidades)],
+        cwd=RAIZ, env=entorno, check=True, stdout=subprocess.PIPE, text=True)
+    return json.loads(proceso.stdout.strip().splitlines()[-1])
+
+
+# Métricas que se comparan contra la línea base; la latencia p99 es demasiado ruidosa
+COMPARADAS = ['p50_ms', 'p90_ms', 'pico_mb', 'bytes_max']
+
+
+def comparar(actual, base, tolerancia):
+    regresiones = []
+    print(f"{'filas':>10} {'callback':<10} {'métrica':<10}{'base':>12}{'actual':>12}{'cambio':>9}")
+    for filas, medidas in actual['tamanos'].items():
+        previas = base['tamanos'].get(filas)
+        if previas is None:
+            continue
+        for nombre, valores in medidas['callbacks'].items():
+            for metrica in COMPARADAS:
+                antes = previas['callbacks'].get(nombre, {}).get(metrica)
+                if not antes:
+                    continue
+                cambio = valores[metrica] / antes - 1
+                marca = ' <-' if cambio > tolerancia else ''
+                print(f'{filas:>10} {nombre:<10} {metrica:<10}{antes:>12}{valores[metrica]:>12}{cambio:>+9.1%}{marca}')
+                if marca:
+                    regresiones.append((filas, nombre, metrica, cambio))
+    return regresiones
+
+
+def resumen(resultados):
+    print(f"{'filas':>10} {'callback':<10}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}{'pico MB':>9}{'KB máx':>9}")
+    for filas, medidas in resultados['tamanos'].items():
+        for nombre, valores in medidas['callbacks'].items():
+            print(f"{filas:>10} {nombre:<10}{valores['p50_ms']:>9}{valores['p90_ms']:>9}{valores['p99_ms']:>9}"
+                  f"{valores['pico_mb']:>9}{valores['bytes_max'] / 1024:>9.1f}")
+        print(f"{filas:>10} carga {medidas['carga_seg']} s, RSS {medidas['rss_max_mb']} MB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mide los callbacks de los tableros sobre citas sintéticas')
+    parser.add_argument('tamanos', nargs='*', default=['10k', '100k', '1m'],
+                        help='filas de cada corrida: 10k, 100k, 1m, 10m o un número')
+    parser.add_argument('--repeticiones', type=int, default=5, help='llamadas por combinación de entradas')
+    parser.add_argument('--especialidades', type=int, default=3,
+                        help="especialidades además de 'Todas' en la matriz de entradas")
+    parser.add_argument('--filas-lote', type=int, default=0,
+                        help='DATOS_FILAS_LOTE para la carga (recomendado con 10m)')
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--guardar', help='JSON donde guardar los resultados (línea base)')
+    parser.add_argument('--comparar', help='JSON de una corrida anterior contra el que comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='empeoramiento aceptado (0.2 = 20%%)')
+    parser.add_argument('--hijo', action='store_true', help=argparse.SUPPRESS)
+    argumentos = parser.parse_args()
+
+    if argumentos.hijo:
+        print(json.dumps(medir(argumentos.repeticiones, argumentos.especialidades)))
+        sys.exit(0)
+
+    # Se lee antes de correr: --guardar puede reemplazar el mismo archivo
+    base = None
+    if argumentos.comparar:
+        with open(argumentos.comparar, encoding='utf-8') as f:
+            base = json.load(f)
+
+    resultados = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'maquina': platform.node(),
+        'repeticiones': argumentos.repeticiones,
+        'tamanos': {},
+    }
+    for tamano in argumentos.tamanos:
+        filas = filas_de(tamano)
+        resultados['tamanos'][str(filas)] = correr_tamano(filas, argumentos)
+    resumen(resultados)
+
+    if argumentos.guardar:
+        os.makedirs(os.path.dirname(argumentos.guardar) or '.', exist_ok=True)
+        with open(argumentos.guardar, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2)
+    if base is not None:
+        regresiones = comparar(resultados, base, argumentos.tolerancia)
+        if regresiones and base.get('maquina') != resultados['maquina']:
+            print(f"La línea base es de otra máquina ({base.get('maquina')}): no se cuenta como regresión")
+        elif regresiones:
+            print(f'{len(regresiones)} métricas empeoraron más de {argumentos.tolerancia:.0%}')
+            sys.exit(1)
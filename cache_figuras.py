@@ -0,0 +1,109 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+
+import diskcache
+from dash.exceptions import PreventUpdate
+
+from coalescer import superada
+import metricas
+import perfilador
+
+logger = logging.getLogger(__name__)
+
+# Cache en disco compartido por todos los workers de gunicorn (SQLite + archivos)
+DIR_CACHE = os.environ.get('CACHE_FIGURAS_DIR', 'data/cache_figuras')
+LIMITE_MB = int(os.environ.get('CACHE_FIGURAS_MB', '256'))
+
+cache = diskcache.Cache(
+    DIR_CACHE,
+    size_limit=LIMITE_MB * 2 ** 20,
+    eviction_policy='least-recently-used',
+)
+
+_FALTA = object()
+
+
+def normalizar(valor):
+    # De clickData solo importa qué punto se eligió, no su posición en pantalla
+    if isinstance(valor, dict) and 'points' in valor:
+        return {'points': [
+            {k: normalizar(punto[k]) for k in ('x', 'y', 'label') if k in punto}
+            for punto in valor['points']
+        ]}
+    if isinstance(valor, dict):
+        return {k: normalizar(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [normalizar(v) for v in valor]
+    if hasattr(valor, 'item'):
+        valor = valor.item()
+    if isinstance(valor, float) and valor.is_integer():
+        return int(valor)
+    return valor
+
+
+def clave_cache(version, nombre, entradas):
+    texto = json.dumps(normalizar(list(entradas)), sort_keys=True, ensure_ascii=False, default=str)
+    return f'{version}:{nombre}:{hashlib.sha1(texto.encode()).hexdigest()}'
+
+
+def a_json(salida):
+    # Se guardan dicts listos para Dash; reconstruir go.Figure al leer volvería a validar
+    if isinstance(salida, (list, tuple)):
+        return [a_json(s) for s in salida]
+    if hasattr(salida, 'to_plotly_json'):
+        return salida.to_plotly_json()
+    return salida
+
+
+def memoizar(nombre, obtener_version):
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*entradas):
+            clave = clave_cache(obtener_version(), nombre, entradas)
+            # Una petición perfilada se calcula siempre: un acierto no mostraría nada
+            if perfilador.perfilando():
+                salida = _FALTA
+            else:
+                with metricas.etapa('cache'):
+                    salida = cache.get(clave, default=_FALTA)
+            if salida is not _FALTA:
+                metricas.cache(nombre, 'acierto')
+                return salida
+            # Un slider arrastrado ya mandó otro valor: esta figura no se vería
+            if superada():
+                metricas.cache(nombre, 'superada')
+                raise PreventUpdate
+            metricas.cache(nombre, 'fallo')
+            salida = funcion(*entradas)
+            with metricas.etapa('serializacion'):
+                salida = a_json(salida)
+            with metricas.etapa('cache'):
+                cache.set(clave, salida)
+            return salida
+        return envoltura
+    return decorador
+
+
+# Nombre de cada resultado en dash_cache_figuras_consultas y en /cache-figuras
+RESULTADOS = {'acierto': 'aciertos', 'fallo': 'fallos', 'superada': 'superadas'}
+
+
+def estadisticas():
+    # Los aciertos y fallos salen del contador de Prometheus (en memoria de cada worker, sumado
+    # entre todos), no de escrituras al disco en cada consulta
+    por_callback = {}
+    for (nombre, resultado), n in metricas.consultas_cache().items():
+        if resultado in RESULTADOS:
+            por_callback.setdefault(nombre, {'aciertos': 0, 'fallos': 0, 'superadas': 0})[RESULTADOS[resultado]] = int(n)
+    for valores in por_callback.values():
+        total = valores['aciertos'] + valores['fallos']
+        valores['tasa_aciertos'] = round(valores['aciertos'] / total, 4) if total else None
+    return {
+        'entradas': len(cache),
+        'bytes': cache.volume(),
+        'limite_bytes': LIMITE_MB * 2 ** 20,
+        'callbacks': por_callback,
+    }
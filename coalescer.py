@@ -0,0 +1,73 @@
+import collections
+import os
+import threading
+import time
+
+import diskcache
+from flask import has_request_context, request
+
+# Mientras se arrastra un slider cada pestaña manda una petición por valor intermedio y solo
+# la última se ve. assets/coalescer.js numera las peticiones de cada carga de página; acá se
+# guarda el número más alto visto por página y salida, y una petición con un número menor quedó
+# superada: se descarta antes de armar la figura. El número lo pone el navegador porque un
+# worker sync recién ve una petición cuando la toma, no cuando llega.
+# Al llegar, cada petición se anota solo en memoria del worker (sin escribir a disco). La
+# tabla compartida entre workers se consulta y actualiza recién en un fallo del cache de
+# figuras, justo antes del cálculo caro que se quiere evitar
+DIR_COALESCER = os.path.join(os.environ.get('CACHE_FIGURAS_DIR', 'data/cache_figuras'), 'coalescer')
+# Espera antes de calcular, para que una petición más nueva alcance a llegar (0 = no esperar)
+ESPERA_SEG = float(os.environ.get('COALESCER_ESPERA_MS', '0')) / 1000
+# Las pestañas cerradas no avisan; sus entradas vencen solas
+VENCE_SEG = 3600
+
+# Claves que se recuerdan en cada worker; las más viejas se olvidan
+MAX_LOCALES = 10000
+
+ultimas = diskcache.Cache(DIR_COALESCER, eviction_policy='none')
+_locales = collections.OrderedDict()
+_candado = threading.Lock()
+
+
+def _peticion():
+    # (clave, número) de la petición de callback en curso, o None fuera de un callback
+    # o si el navegador no mandó número
+    if not has_request_context() or not request.is_json:
+        return None
+    cuerpo = request.get_json(silent=True) or {}
+    secuencia = cuerpo.get('secuencia')
+    if not isinstance(secuencia, dict) or not isinstance(secuencia.get('n'), int):
+        return None
+    return f"{secuencia.get('sesion')}:{cuerpo.get('output')}", secuencia['n']
+
+
+def registrar():
+    # Anota en este worker la petición en curso si es la más nueva de su pestaña y salida
+    peticion = _peticion()
+    if peticion is None:
+        return
+    clave, n = peticion
+    with _candado:
+        if n > _locales.get(clave, -1):
+            _locales[clave] = n
+            _locales.move_to_end(clave)
+            if len(_locales) > MAX_LOCALES:
+                _locales.popitem(last=False)
+
+
+def superada():
+    # True si ya llegó una petición más nueva para la misma pestaña y salida
+    peticion = _peticion()
+    if peticion is None:
+        return False
+    clave, n = peticion
+    if ESPERA_SEG:
+        time.sleep(ESPERA_SEG)
+    with _candado:
+        if _locales.get(clave, -1) > n:
+            return True
+    # Otro worker puede haber tomado una más nueva; si no, esta queda como la más nueva
+    with ultimas.transact():
+        if ultimas.get(clave, -1) > n:
+            return True
+        ultimas.set(clave, n, expire=VENCE_SEG)
+    return False
@@ -0,0 +1,144 @@
+import copy
+import logging
+import time
+
+import pandas as pd
+from flask import g, has_app_context
+
+from agregados import CuboCitas, HistogramaDias, SerieFechas
+from datos import (FILAS_LOTE, buscar_actualizacion, buscar_particiones, cargar_datos, cargar_particiones,
+                   leer_particiones)
+
+logger = logging.getLogger(__name__)
+
+
+class ConjuntoDatos:
+    # Una versión de los datos con todo lo que las vistas consultan. Nunca se modifica:
+    # una versión nueva es otro objeto, armado sumando solo las filas nuevas cuando
+    # el snapshot es el anterior más filas al final
+
+    def __init__(self, df, metadatos, anterior=None):
+        self.df = df
+        self.metadatos = metadatos
+        self.version = metadatos['version']
+        self.filas = len(df)
+
+        incremental = anterior is not None and anterior.continua_en(metadatos)
+        if incremental:
+            desde = anterior.filas
+            try:
+                self.cubo = anterior.cubo.con_filas(df, desde)
+                self.dias_edad = anterior.dias_edad.con_filas(df, desde)
+                self.dias_seguro = anterior.dias_seguro.con_filas(df, desde)
+                self.fechas_citas = anterior.fechas_citas.con_filas(df, desde)
+            except ValueError:
+                # Acá df tiene todas las filas, así que se puede reconstruir
+                logger.warning("Las categorías cambiaron de orden; se reconstruyen los agregados")
+                incremental = False
+        if not incremental:
+            self.cubo = CuboCitas(df)
+            # Días exactos de espera, acumulados, para el slider de /edad/ y el umbral y P90 de /modalidad/
+            self.dias_edad = HistogramaDias(df, ['Rango de Edad', 'ESPECIALIDAD', 'SEXO'])
+            # Mediana y P90 de /asegurados/; media y desviación salen de los momentos del cubo
+            self.dias_seguro = HistogramaDias(df, ['SEGURO', 'ESPECIALIDAD', 'ATENDIDO'])
+            # Citas por día de solicitud para la línea de tiempo de /tiempo/ (día, semana o mes)
+            self.fechas_citas = SerieFechas(df, ['ESPECIALIDAD', 'PRESENCIAL_REMOTO', 'ATENDIDO'])
+
+        self.dias_min = df['DIFERENCIA_DIAS'].min()
+        self.dias_max = df['DIFERENCIA_DIAS'].max()
+        # Opciones de los dropdowns, en el mismo orden en que las mostraban los layouts
+        self.valores = {columna: df[columna].unique() for columna in ['SEXO', 'PRESENCIAL_REMOTO', 'ATENDIDO']}
+        self.valores['ESPECIALIDAD'] = sorted(df['ESPECIALIDAD'].unique())
+
+    def continua_en(self, metadatos):
+        # True si `metadatos` describe estos mismos datos más filas al final
+        return metadatos['version_previa'] == self.version and metadatos['filas_previas'] == self.filas
+
+    def _sumar(self, lote):
+        # Suma un lote a los agregados; solo se usa mientras se arma el objeto
+        self.filas += len(lote)
+        self.cubo = self.cubo.con_filas(lote, 0)
+        self.dias_edad = self.dias_edad.con_filas(lote, 0)
+        self.dias_seguro = self.dias_seguro.con_filas(lote, 0)
+        self.fechas_citas = self.fechas_citas.con_filas(lote, 0)
+        self.dias_min = pd.Series([self.dias_min, lote['DIFERENCIA_DIAS'].min()]).min()
+        self.dias_max = pd.Series([self.dias_max, lote['DIFERENCIA_DIAS'].max()]).max()
+        valores = {columna: pd.unique(pd.concat([pd.Series(self.valores[columna], dtype=object),
+                                                 pd.Series(lote[columna].unique(), dtype=object)]))
+                   for columna in ['SEXO', 'PRESENCIAL_REMOTO', 'ATENDIDO']}
+        valores['ESPECIALIDAD'] = sorted(set(self.valores['ESPECIALIDAD']) | set(lote['ESPECIALIDAD'].unique()))
+        self.valores = valores
+
+    @classmethod
+    def desde_lotes(cls, lotes, metadatos, anterior=None):
+        # Modo por lotes: no se guarda ningún DataFrame; cada lote se suma a los agregados y
+        # se suelta. Con `anterior` los lotes son solo las filas agregadas después de él
+        conjunto = None
+        for lote in lotes:
+            if conjunto is None and anterior is None:
+                conjunto = cls(lote, metadatos)
+                continue
+            if conjunto is None:
+                conjunto = copy.copy(anterior)
+            conjunto._sumar(lote)
+        if conjunto is None:
+            if anterior is None:
+                raise ValueError("La fuente no tiene filas")
+            conjunto = copy.copy(anterior)
+        conjunto.df = None
+        conjunto.metadatos = metadatos
+        conjunto.version = metadatos['version']
+        return conjunto
+
+
+_actual = None
+
+
+def iniciar():
+    global _actual
+    if FILAS_LOTE:
+        manifiesto = cargar_particiones()
+        _actual = ConjuntoDatos.desde_lotes(leer_particiones(manifiesto), manifiesto)
+    else:
+        df, metadatos = cargar_datos()
+        _actual = ConjuntoDatos(df, metadatos)
+    return _actual
+
+
+def actual():
+    # La versión queda fijada en flask.g durante toda la petición: si hay un cambio a
+    # mitad de camino, la petición termina con la versión con la que empezó
+    if not has_app_context():
+        return _actual
+    if 'conjunto' not in g:
+        g.conjunto = _actual
+    return g.conjunto
+
+
+def refrescar(intervalo=0, preparar=None):
+    # Busca una versión nueva fuera del camino de las peticiones y la activa con una sola
+    # asignación; devuelve True si cambió. preparar(nuevo) corre antes de activarla (el
+    # precalentamiento), así las peticiones no la ven con el cache frío
+    global _actual
+    anterior = _actual
+    inicio = time.perf_counter()
+    if FILAS_LOTE:
+        manifiesto = buscar_particiones(anterior.metadatos, intervalo)
+        if manifiesto is None:
+            return False
+        if anterior.continua_en(manifiesto):
+            nuevo = ConjuntoDatos.desde_lotes(leer_particiones(manifiesto, anterior.filas), manifiesto, anterior)
+        else:
+            nuevo = ConjuntoDatos.desde_lotes(leer_particiones(manifiesto), manifiesto)
+    else:
+        encontrado = buscar_actualizacion(anterior.df, anterior.metadatos, intervalo)
+        if encontrado is None:
+            return False
+        df, metadatos = encontrado
+        nuevo = ConjuntoDatos(df, metadatos, anterior)
+    if preparar is not None:
+        preparar(nuevo)
+    _actual = nuevo
+    logger.info("Datos actualizados: versión %s -> %s, %d filas, %.1f s",
+                anterior.version, _actual.version, _actual.filas, time.perf_counter() - inicio)
+    return True
@@ -0,0 +1,482 @@
+import contextlib
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+logger = logging.getLogger(__name__)
+
+# Origen de los datos
+file_id = "1PWTw-akWr59Gu7MoHra5WXMKwllxK9bp"
+URL_FUENTE = os.environ.get('DATOS_URL', f"https://drive.google.com/uc?export=download&id={file_id}")
+RUTA_CSV = os.environ.get('DATOS_CSV', 'data/citas.csv')
+DIR_SNAPSHOT = os.environ.get('DATOS_SNAPSHOT_DIR', 'data')
+
+# Se incrementa cada vez que cambian las columnas guardadas en el snapshot (o cómo se
+# escriben), así un snapshot viejo nunca se lee con un esquema nuevo
+VERSION_ESQUEMA = 4
+
+
+def ruta_snapshot():
+    return os.path.join(DIR_SNAPSHOT, f'citas_v{VERSION_ESQUEMA}.arrow')
+
+
+# Esquema de rangos: cada tramo cubre [borde inferior, borde superior)
+RANGOS_EDAD = {
+    'columna': 'EDAD',
+    'destino': 'Rango de Edad',
+    'bordes': [-np.inf, 13, 19, 30, 61, 200],
+    'etiquetas': ["Niño", "Adolescente", "Joven", "Adulto", "Adulto mayor"],
+}
+
+RANGOS_DIAS = {
+    'columna': 'DIFERENCIA_DIAS',
+    'destino': 'RANGO_DIAS',
+    'bordes': [-np.inf, 10, 20, 30, 40, 50, 60, 70, 80, 90, np.inf],
+    'etiquetas': ["0-9", "10-19", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80-89", "90+"],
+}
+
+ESQUEMA_RANGOS = [RANGOS_EDAD, RANGOS_DIAS]
+
+
+def aplicar_rangos(df, esquema=ESQUEMA_RANGOS):
+    # Un solo pd.cut por columna; el resultado es un categórico ordenado
+    for rango in esquema:
+        df[rango['destino']] = pd.cut(
+            df[rango['columna']],
+            bins=rango['bordes'],
+            labels=rango['etiquetas'],
+            right=False,
+            ordered=True,
+        )
+        sin_rango = int(df[rango['destino']].isna().sum())
+        if sin_rango:
+            logger.warning("%d filas con %s vacío o fuera de los rangos definidos", sin_rango, rango['columna'])
+    return df
+
+
+# Columnas de baja cardinalidad que se guardan como categóricos
+COLUMNAS_CATEGORICAS = ['ESPECIALIDAD', 'SEXO', 'PRESENCIAL_REMOTO', 'ATENDIDO', 'SEGURO', 'MES']
+COLUMNAS_NUMERICAS = ['EDAD', 'DIFERENCIA_DIAS']
+
+
+def reducir_numerico(serie):
+    valores = serie.dropna()
+    enteros = len(valores) == 0 or bool((valores == valores.round()).all())
+    if not enteros:
+        return pd.to_numeric(serie, downcast='float')
+    if len(valores) == len(serie):
+        return pd.to_numeric(serie.astype('int64'), downcast='integer')
+    # Enteros con vacíos: float32 los representa exactos hasta 2**24
+    if len(valores) == 0 or valores.abs().max() < 2 ** 24:
+        return serie.astype('float32')
+    return serie
+
+
+def reportar_memoria(antes, despues, tipos):
+    lineas = [f"{'columna':<20}{'antes (KB)':>12}{'después (KB)':>14}  tipo"]
+    for columna in despues.index:
+        lineas.append(
+            f"{columna:<20}{antes.get(columna, 0) / 1024:>12.1f}{despues[columna] / 1024:>14.1f}  {tipos[columna]}"
+        )
+    lineas.append(f"{'total':<20}{antes.sum() / 1024:>12.1f}{despues.sum() / 1024:>14.1f}")
+    logger.info("Memoria por columna:\n%s", "\n".join(lineas))
+
+
+def compactar_tipos(df, reportar=True):
+    antes = df.memory_usage(deep=True, index=False) if reportar else None
+    for columna in COLUMNAS_CATEGORICAS:
+        if columna in df and not isinstance(df[columna].dtype, pd.CategoricalDtype):
+            df[columna] = df[columna].astype('category')
+    for columna in COLUMNAS_NUMERICAS:
+        if columna in df:
+            df[columna] = reducir_numerico(df[columna])
+    if reportar:
+        reportar_memoria(antes, df.memory_usage(deep=True, index=False), df.dtypes)
+    return df
+
+
+def derivar_columnas(df, reportar=True):
+    df = aplicar_rangos(df)
+
+    # Preparar datos de fecha
+    df['DIA_SOLICITACITA'] = pd.to_datetime(df['DIA_SOLICITACITA'], errors='coerce')
+    df['MES'] = df['DIA_SOLICITACITA'].dt.to_period('M').astype(str)
+    return compactar_tipos(df, reportar)
+
+
+def leer_fuente():
+    # Primero el CSV local; la red solo se usa si no existe
+    if os.path.exists(RUTA_CSV):
+        with open(RUTA_CSV, 'rb') as f:
+            return f.read(), RUTA_CSV
+    with urllib.request.urlopen(URL_FUENTE, timeout=120) as respuesta:
+        return respuesta.read(), URL_FUENTE
+
+
+def version_de(contenido):
+    return hashlib.sha1(contenido).hexdigest()[:12]
+
+
+def guardar_snapshot(df, ruta, version, longitud=0, version_previa='', filas_previas=0):
+    # longitud: bytes de la fuente; permite reconocer después que la fuente solo creció.
+    # version_previa/filas_previas: si el snapshot es el anterior más filas al final
+    tabla = pa.Table.from_pandas(df, preserve_index=False)
+    for i, columna in enumerate(tabla.column_names):
+        # NaN como valor y no como vacío: sin bitmap de validez la columna se lee sin copia
+        if pd.api.types.is_float_dtype(df[columna]):
+            tabla = tabla.set_column(i, columna, pa.array(df[columna].to_numpy(), from_pandas=False))
+    metadatos = dict(tabla.schema.metadata or {})
+    metadatos[b'version'] = version.encode()
+    metadatos[b'esquema'] = str(VERSION_ESQUEMA).encode()
+    metadatos[b'longitud'] = str(longitud).encode()
+    metadatos[b'version_previa'] = version_previa.encode()
+    metadatos[b'filas_previas'] = str(filas_previas).encode()
+    tabla = tabla.replace_schema_metadata(metadatos)
+
+    # Se escribe a un temporal y se renombra para que ningún worker lea un archivo a medias
+    os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    # Un solo record batch: con varios (por defecto uno cada 64k filas) to_pandas tiene que
+    # unir los trozos y copia cada columna fuera del mapa
+    feather.write_feather(tabla.combine_chunks(), temporal, compression='uncompressed',
+                          chunksize=max(tabla.num_rows, 1))
+    os.replace(temporal, ruta)
+
+
+def metadatos_de(esquema):
+    metadatos = esquema.metadata
+    return {
+        'version': metadatos[b'version'].decode(),
+        'longitud': int(metadatos.get(b'longitud', b'0')),
+        'version_previa': metadatos.get(b'version_previa', b'').decode(),
+        'filas_previas': int(metadatos.get(b'filas_previas', b'0')),
+    }
+
+
+def leer_metadatos(ruta):
+    # Solo el esquema: no se lee ninguna columna
+    with pa.memory_map(ruta) as fuente:
+        return metadatos_de(pa.ipc.open_file(fuente).schema)
+
+
+def leer_snapshot(ruta, reportar=True):
+    # Arrow IPC sin compresión: se abre con memory map y no se vuelve a parsear nada.
+    # split_blocks evita consolidar columnas en bloques 2D: las columnas sin vacíos quedan
+    # como vistas de solo lectura sobre el archivo mapeado, sin copia, y sus páginas las
+    # comparte el kernel entre todos los workers que abren el mismo snapshot
+    with pa.memory_map(ruta) as fuente:
+        tabla = pa.ipc.open_file(fuente).read_all()
+    metadatos = metadatos_de(tabla.schema)
+    asignado = pa.total_allocated_bytes()
+    df = tabla.to_pandas(split_blocks=True)
+    if reportar:
+        logger.info("Snapshot %s: %d filas, %.1f MB en memoria, %.1f MB copiados fuera del mapa", ruta, len(df),
+                    df.memory_usage(deep=True, index=False).sum() / 2 ** 20,
+                    (pa.total_allocated_bytes() - asignado) / 2 ** 20)
+    return df, metadatos
+
+
+def construir_snapshot():
+    contenido, origen = leer_fuente()
+    logger.info("Construyendo snapshot desde %s", origen)
+    df = derivar_columnas(pd.read_csv(io.BytesIO(contenido)))
+    version = version_de(contenido)
+    guardar_snapshot(df, ruta_snapshot(), version, longitud=len(contenido))
+    # Se vuelve a abrir mapeado para que el frame en uso sea el compartido
+    return leer_snapshot(ruta_snapshot())
+
+
+def anexar(df, nuevas):
+    # Filas nuevas al final; los categóricos se unen agregando las categorías nuevas al
+    # final, así los códigos existentes no cambian y solo se recodifica lo que hace falta
+    df = df.copy(deep=False)
+    nuevas = nuevas.copy(deep=False)
+    for columna in df.columns:
+        if not (isinstance(df[columna].dtype, pd.CategoricalDtype) and columna in nuevas
+                and isinstance(nuevas[columna].dtype, pd.CategoricalDtype)):
+            continue
+        categorias = df[columna].cat.categories
+        extra = nuevas[columna].cat.categories.difference(categorias, sort=False)
+        if len(extra):
+            categorias = categorias.append(extra)
+            df[columna] = df[columna].cat.set_categories(categorias)
+        nuevas[columna] = nuevas[columna].cat.set_categories(categorias)
+    return pd.concat([df, nuevas[df.columns]], ignore_index=True)
+
+
+@contextlib.contextmanager
+def bloqueo_snapshot():
+    # Un solo worker a la vez revisa la fuente y reescribe el snapshot
+    os.makedirs(DIR_SNAPSHOT, exist_ok=True)
+    with open(os.path.join(DIR_SNAPSHOT, 'snapshot.lock'), 'w') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+def buscar_actualizacion(df, metadatos, intervalo=0):
+    # Devuelve (df, metadatos) de una versión más nueva que `metadatos`, o None.
+    # Si otro worker ya actualizó el snapshot se usa ese; la fuente se revisa a lo sumo
+    # una vez por `intervalo` entre todos los workers. Cuando la fuente solo creció
+    # (los primeros `longitud` bytes no cambiaron) se parsean y derivan solo las filas nuevas
+    ruta = ruta_snapshot()
+    marca = os.path.join(DIR_SNAPSHOT, 'fuente.revisada')
+    with bloqueo_snapshot():
+        if os.path.exists(ruta) and leer_metadatos(ruta)['version'] != metadatos['version']:
+            return leer_snapshot(ruta)
+        if os.path.exists(marca) and time.time() - os.path.getmtime(marca) < intervalo:
+            return None
+        contenido, origen = leer_fuente()
+        with open(marca, 'w'):
+            pass
+        version = version_de(contenido)
+        if version == metadatos['version']:
+            return None
+
+        longitud = metadatos['longitud']
+        solo_crecio = (0 < longitud < len(contenido)
+                       and contenido[longitud - 1:longitud] == b'\n'
+                       and version_de(contenido[:longitud]) == metadatos['version'])
+        if solo_crecio:
+            encabezado = contenido[:contenido.index(b'\n') + 1]
+            nuevas = derivar_columnas(pd.read_csv(io.BytesIO(encabezado + contenido[longitud:])))
+            logger.info("Fuente %s: %d filas nuevas al final", origen, len(nuevas))
+            total = anexar(df, nuevas)
+            guardar_snapshot(total, ruta, version, longitud=len(contenido),
+                             version_previa=metadatos['version'], filas_previas=len(df))
+        else:
+            logger.info("Fuente %s cambió; se reconstruye el snapshot completo", origen)
+            total = derivar_columnas(pd.read_csv(io.BytesIO(contenido)))
+            guardar_snapshot(total, ruta, version, longitud=len(contenido))
+        return leer_snapshot(ruta)
+
+
+def cargar_datos():
+    ruta = ruta_snapshot()
+    if os.path.exists(ruta):
+        try:
+            return leer_snapshot(ruta)
+        except (OSError, pa.ArrowInvalid, KeyError):
+            logger.warning("Snapshot %s ilegible, se reconstruye", ruta, exc_info=True)
+    return construir_snapshot()
+
+
+# Ingesta por lotes, para fuentes que no entran en memoria. Con DATOS_FILAS_LOTE > 0 el CSV
+# se lee de a ese número de filas; cada lote se deriva y se guarda como una partición Arrow,
+# y los agregados se arman sumando las particiones una por una. El pico de memoria depende
+# del tamaño del lote y no del total de filas
+FILAS_LOTE = int(os.environ.get('DATOS_FILAS_LOTE', '0'))
+
+
+def dir_particiones():
+    return os.path.join(DIR_SNAPSHOT, f'citas_v{VERSION_ESQUEMA}_partes')
+
+
+def ruta_manifiesto():
+    return os.path.join(dir_particiones(), 'manifiesto.json')
+
+
+def fuente_en_disco():
+    # En modo por lotes la fuente se lee desde disco; si no hay CSV local se descarga por bloques
+    if os.path.exists(RUTA_CSV):
+        return RUTA_CSV
+    ruta = os.path.join(DIR_SNAPSHOT, 'fuente_descargada.csv')
+    os.makedirs(DIR_SNAPSHOT, exist_ok=True)
+    temporal = f'{ruta}.{os.getpid()}.tmp'
+    with urllib.request.urlopen(URL_FUENTE, timeout=120) as respuesta, open(temporal, 'wb') as f:
+        shutil.copyfileobj(respuesta, f, 2 ** 20)
+    os.replace(temporal, ruta)
+    return ruta
+
+
+def huella(ruta, longitud):
+    # Igual a version_de() de los primeros `longitud` bytes, sin cargarlos juntos
+    h = hashlib.sha1()
+    with open(ruta, 'rb') as f:
+        while longitud > 0:
+            bloque = f.read(min(longitud, 2 ** 20))
+            if not bloque:
+                break
+            h.update(bloque)
+            longitud -= len(bloque)
+    return h.hexdigest()[:12]
+
+
+class LectorAcotado:
+    # Archivo que termina en `fin` aunque mientras tanto le agreguen filas: lo leído
+    # coincide siempre con la huella calculada
+    def __init__(self, archivo, fin):
+        self.archivo = archivo
+        self.fin = fin
+
+    def read(self, n=-1):
+        restante = max(self.fin - self.archivo.tell(), 0)
+        if n is None or n < 0 or n > restante:
+            n = restante
+        return self.archivo.read(n)
+
+    def __iter__(self):
+        return iter(self.read().splitlines(keepends=True))
+
+
+def leer_lotes(ruta, fin, desde=0):
+    # Lotes derivados de los bytes [desde, fin) del CSV; desde > 0 debe caer en un inicio de línea
+    columnas = pd.read_csv(ruta, nrows=0).columns
+    with open(ruta, 'rb') as archivo:
+        opciones = {}
+        if desde:
+            archivo.seek(desde)
+            opciones = {'header': None, 'names': columnas}
+        try:
+            for lote in pd.read_csv(LectorAcotado(archivo, fin), chunksize=FILAS_LOTE, **opciones):
+                yield derivar_columnas(lote.reset_index(drop=True), reportar=False)
+        except pd.errors.EmptyDataError:
+            return
+
+
+def unificar_categorias(lote, categorias):
+    # `categorias` acumula las de los lotes anteriores; las nuevas van al final, así los
+    # códigos de los lotes ya guardados siguen valiendo y cada partición amplía la anterior
+    lote = lote.copy(deep=False)
+    for columna in lote.columns:
+        if not isinstance(lote[columna].dtype, pd.CategoricalDtype):
+            continue
+        previas = categorias.get(columna)
+        if previas is None:
+            categorias[columna] = lote[columna].cat.categories
+            continue
+        extra = lote[columna].cat.categories.difference(previas, sort=False)
+        if len(extra):
+            previas = categorias[columna] = previas.append(extra)
+        lote[columna] = lote[columna].cat.set_categories(previas)
+    return lote
+
+
+def leer_manifiesto():
+    with open(ruta_manifiesto(), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def leer_particiones(manifiesto, saltar_filas=0):
+    # Una partición a la vez, mapeada; saltar_filas descarta las que ya se sumaron
+    for parte in manifiesto['partes']:
+        if saltar_filas >= parte['filas']:
+            saltar_filas -= parte['filas']
+            continue
+        df, _ = leer_snapshot(os.path.join(dir_particiones(), parte['archivo']), reportar=False)
+        yield df
+
+
+def escribir_particiones(ruta, fin, version, previo=None):
+    # Sin `previo` se particiona la fuente completa; con `previo` solo los bytes que se
+    # agregaron después de previo['longitud'], como particiones nuevas al final
+    directorio = dir_particiones()
+    os.makedirs(directorio, exist_ok=True)
+    partes = list(previo['partes']) if previo else []
+    categorias = {}
+    if partes:
+        ultima, _ = leer_snapshot(os.path.join(directorio, partes[-1]['archivo']), reportar=False)
+        unificar_categorias(ultima, categorias)
+    filas_previas = sum(parte['filas'] for parte in partes)
+
+    for i, lote in enumerate(leer_lotes(ruta, fin, previo['longitud'] if previo else 0)):
+        archivo = f'{version}-{i:05d}.arrow'
+        guardar_snapshot(unificar_categorias(lote, categorias), os.path.join(directorio, archivo), version)
+        partes.append({'archivo': archivo, 'filas': len(lote)})
+
+    manifiesto = {
+        'version': version,
+        'longitud': fin,
+        'version_previa': previo['version'] if previo else '',
+        'filas_previas': filas_previas if previo else 0,
+        'partes': partes,
+    }
+    temporal = f'{ruta_manifiesto()}.{os.getpid()}.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f)
+    os.replace(temporal, ruta_manifiesto())
+
+    # Las particiones de versiones anteriores ya no las nombra el manifiesto; quien aún
+    # las tenga mapeadas las sigue leyendo hasta soltarlas
+    vigentes = {parte['archivo'] for parte in partes} | {'manifiesto.json'}
+    for archivo in os.listdir(directorio):
+        if archivo not in vigentes and not archivo.endswith('.tmp'):
+            os.remove(os.path.join(directorio, archivo))
+    logger.info("Particiones %s: versión %s, %d filas en %d partes", directorio, version,
+                sum(parte['filas'] for parte in partes), len(partes))
+    return manifiesto
+
+
+def construir_particiones():
+    ruta = fuente_en_disco()
+    fin = os.path.getsize(ruta)
+    logger.info("Particionando %s de a %d filas", ruta, FILAS_LOTE)
+    return escribir_particiones(ruta, fin, huella(ruta, fin))
+
+
+def cargar_particiones():
+    with bloqueo_snapshot():
+        if os.path.exists(ruta_manifiesto()):
+            try:
+                return leer_manifiesto()
+            except (OSError, ValueError):
+                logger.warning("Manifiesto %s ilegible, se reconstruye", ruta_manifiesto(), exc_info=True)
+        return construir_particiones()
+
+
+def buscar_particiones(metadatos, intervalo=0):
+    # Como buscar_actualizacion, para el modo por lotes: devuelve el manifiesto de una
+    # versión más nueva que `metadatos`, o None
+    marca = os.path.join(DIR_SNAPSHOT, 'fuente.revisada')
+    with bloqueo_snapshot():
+        if os.path.exists(ruta_manifiesto()):
+            manifiesto = leer_manifiesto()
+            if manifiesto['version'] != metadatos['version']:
+                return manifiesto
+        if os.path.exists(marca) and time.time() - os.path.getmtime(marca) < intervalo:
+            return None
+        ruta = fuente_en_disco()
+        with open(marca, 'w'):
+            pass
+        fin = os.path.getsize(ruta)
+        version = huella(ruta, fin)
+        if version == metadatos['version']:
+            return None
+
+        longitud = metadatos['longitud']
+        solo_crecio = 0 < longitud < fin and huella(ruta, longitud) == metadatos['version']
+        if solo_crecio:
+            with open(ruta, 'rb') as f:
+                f.seek(longitud - 1)
+                solo_crecio = f.read(1) == b'\n'
+        if solo_crecio:
+            logger.info("Fuente %s: %d bytes nuevos al final", ruta, fin - longitud)
+            return escribir_particiones(ruta, fin, version, previo=metadatos)
+        logger.info("Fuente %s cambió; se vuelve a particionar completa", ruta)
+        return escribir_particiones(ruta, fin, version)
+
+
+if __name__ == '__main__':
+    # Permite generar el snapshot en el build, antes de levantar gunicorn
+    logging.basicConfig(level=logging.INFO)
+    if FILAS_LOTE:
+        with bloqueo_snapshot():
+            manifiesto = construir_particiones()
+        print(f"Particiones {dir_particiones()} - {len(manifiesto['partes'])} partes - "
+              f"versión {manifiesto['version']}")
+    else:
+        df, metadatos = construir_snapshot()
+        print(f"Snapshot {ruta_snapshot()} - {len(df)} filas - versión {metadatos['version']}")
@@ -0,0 +1,194 @@
+import base64
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+import plotly.io as pio
+
+from metricas import etapa
+
+# 'rapido': figuras como dicts sin validar y JSON con orjson
+# 'px': el camino original con plotly.express, para comparar
+MOTOR = os.environ.get('FIGURAS_MOTOR', 'rapido')
+
+# Arreglos numéricos en base64 ({'dtype', 'bdata'}); requiere plotly.js >= 2.28, más nuevo
+# que el que trae dash 2.14, así que solo se activa si se sirve uno propio desde assets/
+ARREGLOS_TIPADOS = os.environ.get('FIGURAS_ARREGLOS_TIPADOS', '0') == '1'
+
+pio.json.config.default_engine = 'orjson' if MOTOR == 'rapido' else 'json'
+
+COLOR = '#636efa'
+
+_plantillas = {}
+
+
+def plantilla(nombre):
+    # El template se convierte a dict una sola vez; es la mayor parte de cada figura
+    if nombre not in _plantillas:
+        _plantillas[nombre] = pio.templates[nombre].to_plotly_json()
+    return _plantillas[nombre]
+
+
+def arreglo(valores):
+    valores = np.asarray(valores)
+    if valores.dtype.kind not in 'iuf':
+        return valores.tolist()
+    if not ARREGLOS_TIPADOS:
+        # orjson serializa los arreglos numpy directamente
+        return valores
+    if valores.dtype.kind in 'iu' and len(valores) and np.abs(valores).max() < 2 ** 31:
+        valores = valores.astype('<i4')
+        tipo = 'i4'
+    else:
+        valores = valores.astype('<f8')
+        tipo = 'f8'
+    return {'dtype': tipo, 'bdata': base64.b64encode(valores.tobytes()).decode('ascii')}
+
+
+def eje(titulo, ancla, **extra):
+    return {'anchor': ancla, 'domain': [0.0, 1.0], 'title': {'text': titulo}, **extra}
+
+
+@etapa('figura')
+def barras(x, y, titulo, eje_x='x', eje_y='y', orden=None, template='plotly_white'):
+    if MOTOR == 'px':
+        return px.bar(
+            x=x,
+            y=y,
+            category_orders={'x': orden} if orden is not None else None,
+            labels={'x': eje_x, 'y': eje_y},
+            title=titulo,
+            template=template
+        )
+    extra_x = {'categoryorder': 'array', 'categoryarray': list(orden)} if orden is not None else {}
+    return {
+        'data': [{
+            'alignmentgroup': 'True',
+            'hovertemplate': f'{eje_x}=%{{x}}<br>{eje_y}=%{{y}}<extra></extra>',
+            'legendgroup': '',
+            'marker': {'color': COLOR, 'pattern': {'shape': ''}},
+            'name': '',
+            'offsetgroup': '',
+            'orientation': 'v',
+            'showlegend': False,
+            'textposition': 'auto',
+            'x': arreglo(x),
+            'xaxis': 'x',
+            'y': arreglo(y),
+            'yaxis': 'y',
+            'type': 'bar',
+        }],
+        'layout': {
+            'template': plantilla(template),
+            'xaxis': eje(eje_x, 'y', **extra_x),
+            'yaxis': eje(eje_y, 'x'),
+            'legend': {'tracegroupgap': 0},
+            'title': {'text': titulo},
+            'barmode': 'relative',
+        },
+    }
+
+
+@etapa('figura')
+def pie(etiquetas, valores, titulo, template='plotly_white', alto=None):
+    if MOTOR == 'px':
+        return px.pie(names=etiquetas, values=valores, title=titulo, template=template, height=alto)
+    layout = {
+        'template': plantilla(template),
+        'legend': {'tracegroupgap': 0},
+        'title': {'text': titulo},
+    }
+    if alto is not None:
+        layout['height'] = alto
+    return {
+        'data': [{
+            'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]},
+            'hovertemplate': 'label=%{label}<br>value=%{value}<extra></extra>',
+            'labels': arreglo(etiquetas),
+            'legendgroup': '',
+            'name': '',
+            'showlegend': True,
+            'values': arreglo(valores),
+            'type': 'pie',
+        }],
+        'layout': layout,
+    }
+
+
+@etapa('figura')
+def linea(x, y, titulo, eje_x='x', eje_y='y', tickangle=None, uirevision=None, template='plotly_white'):
+    # uirevision: mientras no cambie, plotly conserva el zoom del usuario al actualizar datos
+    if MOTOR == 'px':
+        fig = px.line(x=x, y=y, markers=True, labels={'x': eje_x, 'y': eje_y}, title=titulo, template=template)
+        if tickangle is not None:
+            fig.update_xaxes(tickangle=tickangle)
+        if uirevision is not None:
+            fig.update_layout(uirevision=uirevision)
+        return fig
+    extra_x = {'tickangle': tickangle} if tickangle is not None else {}
+    figura = {
+        'data': [{
+            'hovertemplate': f'{eje_x}=%{{x}}<br>{eje_y}=%{{y}}<extra></extra>',
+            'legendgroup': '',
+            'line': {'color': COLOR, 'dash': 'solid'},
+            'marker': {'symbol': 'circle'},
+            'mode': 'markers+lines',
+            'name': '',
+            'orientation': 'v',
+            'showlegend': False,
+            'x': arreglo(x),
+            'xaxis': 'x',
+            'y': arreglo(y),
+            'yaxis': 'y',
+            'type': 'scatter',
+        }],
+        'layout': {
+            'template': plantilla(template),
+            'xaxis': eje(eje_x, 'y', **extra_x),
+            'yaxis': eje(eje_y, 'x'),
+            'legend': {'tracegroupgap': 0},
+            'title': {'text': titulo},
+        },
+    }
+    if uirevision is not None:
+        figura['layout']['uirevision'] = uirevision
+    return figura
+
+
+@etapa('figura')
+def barras_agrupadas(x, series, titulo, eje_x='x', eje_y='y', leyenda='variable', template='plotly_white'):
+    # Una traza por entrada de `series` ({nombre: valores}), lado a lado sobre las mismas x
+    if MOTOR == 'px':
+        largo = pd.DataFrame({eje_x: list(x) * len(series),
+                              leyenda: [nombre for nombre in series for _ in x],
+                              eje_y: np.concatenate([np.asarray(v, dtype='float64') for v in series.values()])})
+        return px.bar(largo, x=eje_x, y=eje_y, color=leyenda, barmode='group', title=titulo, template=template)
+    colores = plantilla(template)['layout']['colorway']
+    x = arreglo(x)
+    return {
+        'data': [{
+            'alignmentgroup': 'True',
+            'hovertemplate': f'{leyenda}={nombre}<br>{eje_x}=%{{x}}<br>{eje_y}=%{{y}}<extra></extra>',
+            'legendgroup': nombre,
+            'marker': {'color': colores[i % len(colores)], 'pattern': {'shape': ''}},
+            'name': nombre,
+            'offsetgroup': nombre,
+            'orientation': 'v',
+            'showlegend': True,
+            'textposition': 'auto',
+            'x': x,
+            'xaxis': 'x',
+            'y': arreglo(valores),
+            'yaxis': 'y',
+            'type': 'bar',
+        } for i, (nombre, valores) in enumerate(series.items())],
+        'layout': {
+            'template': plantilla(template),
+            'xaxis': eje(eje_x, 'y'),
+            'yaxis': eje(eje_y, 'x'),
+            'legend': {'title': {'text': leyenda}, 'tracegroupgap': 0},
+            'title': {'text': titulo},
+            'barmode': 'group',
+        },
+    }
@@ -0,0 +1,37 @@
+import gc
+import os
+import shutil
+import tempfile
+
+# El master importa multi_app una sola vez: lee el snapshot (mapeado en memoria), arma
+# los agregados y precalienta el cache; los workers los heredan con fork, copy-on-write.
+# Así se pueden sumar workers sin multiplicar la RAM. GUNICORN_PRELOAD=0 vuelve a que
+# cada worker cargue por su cuenta (el snapshot mapeado se sigue compartiendo)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+if preload_app:
+    os.environ['GUNICORN_PRECARGA'] = '1'
+
+# Métricas de Prometheus (metricas.py): cada proceso escribe las suyas en este directorio y
+# /metrics las suma. Tiene que existir, y vacío, antes de que se importe la app
+DIR_METRICAS = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                     os.path.join(tempfile.gettempdir(), 'multi_app_metricas'))
+shutil.rmtree(DIR_METRICAS, ignore_errors=True)
+os.makedirs(DIR_METRICAS)
+
+
+def pre_fork(server, worker):
+    # Lo cargado en el master sale del recorrido del GC: si no, cada recolección en un
+    # worker escribiría en los headers de esos objetos y copiaría sus páginas
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import multi_app
+        multi_app.iniciar_hilos()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
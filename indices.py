@@ -0,0 +1,74 @@
+import numpy as np
+
+# Dimensiones de los dropdowns que se indexan al cargar
+DIMENSIONES_FILTRO = ['ESPECIALIDAD', 'SEXO', 'PRESENCIAL_REMOTO', 'ATENDIDO', 'SEGURO', 'Rango de Edad']
+
+# Valores de los dropdowns que significan "sin filtro"
+SIN_FILTRO = ('Todas', 'Todos', None)
+
+
+def intersectar(a, b):
+    # Ambos arreglos están ordenados: se busca cada posición del menor en el mayor,
+    # así el costo depende de la selección más chica y no del tamaño de la tabla
+    if len(a) > len(b):
+        a, b = b, a
+    if len(a) == 0:
+        return a
+    lugares = np.searchsorted(b, a)
+    lugares[lugares == len(b)] = 0
+    return a[b[lugares] == a]
+
+
+class IndiceFiltros:
+    # Para cada valor de cada dimensión guarda las posiciones (ordenadas) de sus filas
+
+    def __init__(self, df, dimensiones=DIMENSIONES_FILTRO):
+        self.total = len(df)
+        self.tipo = np.int32 if len(df) < 2 ** 31 else np.int64
+        self.posiciones = {}
+        self._no_nulos = {}
+        for dimension in dimensiones:
+            if dimension in df:
+                self.posiciones[dimension] = self._indexar(df[dimension])
+
+    def _indexar(self, serie):
+        codigos = serie.cat.codes.to_numpy()
+        categorias = serie.cat.categories
+        # argsort estable: dentro de cada valor las posiciones quedan ascendentes
+        orden = np.argsort(codigos, kind='stable').astype(self.tipo)
+        # Los vacíos tienen código -1 y quedan al principio
+        limites = np.concatenate([[0], np.cumsum(np.bincount(codigos + 1, minlength=len(categorias) + 1))])
+        por_valor = {None: orden[:limites[1]]}
+        for i, valor in enumerate(categorias):
+            por_valor[valor] = orden[limites[i + 1]:limites[i + 2]]
+        return por_valor
+
+    def valor(self, dimension, valor):
+        return self.posiciones[dimension].get(valor, np.empty(0, dtype=self.tipo))
+
+    def no_nulos(self, dimension):
+        if dimension not in self._no_nulos:
+            vacios = self.posiciones[dimension][None]
+            self._no_nulos[dimension] = np.setdiff1d(np.arange(self.total, dtype=self.tipo), vacios,
+                                                     assume_unique=True)
+        return self._no_nulos[dimension]
+
+    def seleccionar(self, filtros, no_nulos=()):
+        # Devuelve las posiciones que cumplen todos los filtros, o None si no hay filtro activo
+        conjuntos = [self.valor(dimension, valor) for dimension, valor in filtros.items()
+                     if valor not in SIN_FILTRO]
+        conjuntos += [self.no_nulos(dimension) for dimension in no_nulos]
+        if not conjuntos:
+            return None
+        conjuntos.sort(key=len)
+        resultado = conjuntos[0]
+        for posiciones in conjuntos[1:]:
+            resultado = intersectar(resultado, posiciones)
+        return resultado
+
+    def filtrar(self, df, filtros, no_nulos=()):
+        # Una sola selección de filas; sin filtros se devuelve el mismo frame, sin copia
+        posiciones = self.seleccionar(filtros, no_nulos)
+        if posiciones is None:
+            return df
+        return df.take(posiciones)
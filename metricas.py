@@ -0,0 +1,184 @@
+import functools
+import inspect
+import os
+import threading
+import time
+
+from flask import has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+
+from indices import SIN_FILTRO
+
+# Métricas Prometheus de los callbacks y las rutas, expuestas en /metrics. Bajo gunicorn
+# cada worker escribe las suyas en PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py) y /metrics
+# las suma. El tiempo de cada callback se reparte en etapas exclusivas: una etapa anidada
+# en otra descuenta su tiempo de la de afuera, así las etapas suman el total
+SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+FILAS = (10, 100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7, 10 ** 8)
+
+callback_segundos = Histogram(
+    'dash_callback_segundos', 'Duración de cada callback, de la llamada a la respuesta serializada',
+    ['callback', 'filtros'], buckets=SEGUNDOS)
+etapa_segundos = Histogram(
+    'dash_callback_etapa_segundos', 'Tiempo de cada etapa por llamada a un callback',
+    ['callback', 'etapa'], buckets=SEGUNDOS)
+callback_filas = Histogram(
+    'dash_callback_filas', 'Citas que cumplen los filtros de cada llamada', ['callback'], buckets=FILAS)
+callback_bytes = Histogram(
+    'dash_callback_respuesta_bytes', 'Tamaño de la respuesta de cada callback', ['callback'], buckets=BYTES)
+cache_consultas = Counter(
+    'dash_cache_figuras_consultas', 'Consultas al cache de figuras por resultado', ['callback', 'resultado'])
+peticion_segundos = Histogram(
+    'flask_peticion_segundos', 'Duración de cada petición por ruta', ['ruta', 'metodo'], buckets=SEGUNDOS)
+respuesta_bytes = Histogram(
+    'flask_respuesta_bytes', 'Tamaño de la respuesta por ruta', ['ruta'], buckets=BYTES)
+
+_local = threading.local()
+
+
+class _Medicion:
+    # Lo que se va juntando durante una llamada a un callback, en el hilo que la atiende
+    def __init__(self, nombre, filtros):
+        self.nombre = nombre
+        self.filtros = filtros
+        self.inicio = time.perf_counter()
+        self.fin = None
+        self.etapas = {}
+        self.pila = []
+        self.filas = None
+
+    def publicar(self, fin):
+        total = fin - self.inicio
+        for etapa, segundos in self.etapas.items():
+            etapa_segundos.labels(self.nombre, etapa).observe(segundos)
+        etapa_segundos.labels(self.nombre, 'otros').observe(max(total - sum(self.etapas.values()), 0))
+        callback_segundos.labels(self.nombre, self.filtros).observe(total)
+        if self.filas is not None:
+            callback_filas.labels(self.nombre).observe(self.filas)
+
+
+def _actual():
+    return getattr(_local, 'medicion', None)
+
+
+class etapa:
+    # with etapa('filtro'): ... o @etapa('figura'). Fuera de un callback medido no hace nada
+    __slots__ = ('nombre', 'medicion')
+
+    def __init__(self, nombre):
+        self.nombre = nombre
+
+    def __enter__(self):
+        self.medicion = medicion = _actual()
+        if medicion is None or medicion.fin is not None:
+            return self
+        ahora = time.perf_counter()
+        if medicion.pila:
+            afuera = medicion.pila[-1]
+            medicion.etapas[afuera[0]] = medicion.etapas.get(afuera[0], 0) + ahora - afuera[1]
+        medicion.pila.append([self.nombre, ahora])
+        return self
+
+    def __exit__(self, *_):
+        medicion = self.medicion
+        if medicion is None or medicion.fin is not None:
+            return False
+        ahora = time.perf_counter()
+        nombre, inicio = medicion.pila.pop()
+        medicion.etapas[nombre] = medicion.etapas.get(nombre, 0) + ahora - inicio
+        if medicion.pila:
+            medicion.pila[-1][1] = ahora
+        return False
+
+    def __call__(self, funcion):
+        nombre = self.nombre
+
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            with etapa(nombre):
+                return funcion(*args, **kwargs)
+        return envoltura
+
+
+def filas(n):
+    medicion = _actual()
+    if medicion is not None:
+        medicion.filas = n
+
+
+def cache(nombre, resultado):
+    cache_consultas.labels(nombre, resultado).inc()
+
+
+def medir_callback(nombre, filtros=()):
+    # Va entre @app.callback y @memoizar. `filtros` son los parámetros que son dropdowns:
+    # la etiqueta 'filtros' dice cuáles tienen un valor elegido (no cuál, así la cantidad de
+    # series queda acotada). Las métricas se publican en after_request, cuando Dash ya
+    # serializó la respuesta; fuera de una petición (precalentamiento) no se mide nada
+    def decorador(funcion):
+        parametros = list(inspect.signature(funcion).parameters)
+        posiciones = [(parametros.index(f), f) for f in filtros]
+
+        @functools.wraps(funcion)
+        def envoltura(*entradas):
+            if not has_request_context():
+                return funcion(*entradas)
+            activos = '+'.join(f for i, f in posiciones if entradas[i] not in SIN_FILTRO) or 'ninguno'
+            medicion = _local.medicion = _Medicion(nombre, activos)
+            try:
+                return funcion(*entradas)
+            finally:
+                medicion.fin = time.perf_counter()
+        return envoltura
+    return decorador
+
+
+def iniciar_peticion():
+    _local.medicion = None
+    _local.inicio_peticion = time.perf_counter()
+
+
+def terminar_peticion(respuesta):
+    ahora = time.perf_counter()
+    ruta = request.url_rule.rule if request.url_rule is not None else 'sin_ruta'
+    inicio = getattr(_local, 'inicio_peticion', None)
+    if inicio is not None:
+        peticion_segundos.labels(ruta, request.method).observe(ahora - inicio)
+    tamano = None if respuesta.direct_passthrough else respuesta.calculate_content_length()
+    if tamano is not None:
+        respuesta_bytes.labels(ruta).observe(tamano)
+
+    medicion = _actual()
+    if medicion is not None and medicion.fin is not None:
+        # Desde que el callback volvió: to_json de Dash y armado de la respuesta
+        medicion.etapas['serializacion'] = medicion.etapas.get('serializacion', 0) + ahora - medicion.fin
+        medicion.publicar(ahora)
+        if tamano is not None:
+            callback_bytes.labels(medicion.nombre).observe(tamano)
+    _local.medicion = None
+    return respuesta
+
+
+def registro():
+    # Con varios workers se suman los archivos de todos
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        combinado = CollectorRegistry()
+        multiprocess.MultiProcessCollector(combinado)
+        return combinado
+    return REGISTRY
+
+
+def exponer():
+    # (cuerpo, content type) de /metrics
+    return generate_latest(registro()), CONTENT_TYPE_LATEST
+
+
+def consultas_cache():
+    # {(callback, resultado): consultas} de dash_cache_figuras_consultas
+    return {
+        (muestra.labels['callback'], muestra.labels['resultado']): muestra.value
+        for familia in registro().collect() if familia.name == 'dash_cache_figuras_consultas'
+        for muestra in familia.samples if muestra.name.endswith('_total')
+    }
@@ -1,60 +1,41 @@
+import inspect
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import numpy as np
 import pandas as pd
 from flask import Flask
 import dash
-from dash import dcc, html
-from dash.dependencies import Input, Output
-import plotly.express as px
-from flask import render_template_string
+from dash import Patch, dcc, html
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask_compress import Compress
+from flask import Response, abort, g, jsonify, redirect, render_template_string, request, send_file
 from datetime import datetime, date
+from urllib.parse import urlsplit
 
-# Cargar los datos
-file_id = "1PWTw-akWr59Gu7MoHra5WXMKwllxK9bp"
-url = f"https://drive.google.com/uc?export=download&id={file_id}"
-df = pd.read_csv(url)
-
-# Clasificación por edad
-def clasificar_edad(edad):
-    if edad < 13:
-        return "Niño"
-    elif edad < 19:
-        return "Adolescente"
-    elif edad < 30:
-        return "Joven"
-    elif edad < 61:
-        return "Adulto"
-    elif edad < 200:
-        return "Adulto mayor"
-
-df['Rango de Edad'] = df['EDAD'].apply(clasificar_edad)
-
-# Clasificación por días de espera
-def clasificar_dias(dias):
-    if dias < 10:
-        return "0-9"
-    elif dias < 20:
-        return "10-19"
-    elif dias < 30:
-        return "20-29"
-    elif dias < 40:
-        return "30-39"
-    elif dias < 50:
-        return "40-49"
-    elif dias < 60:
-        return "50-59"
-    elif dias < 70:
-        return "60-69"
-    elif dias < 80:
-        return "70-79"
-    elif dias < 90:
-        return "80-89"
-    else:
-        return "90+"
+from agregados import TOP_N, lttb
+from cache_figuras import estadisticas, memoizar
+import coalescer
+import metricas
+import perfilador
+import conjunto
+from datos import RANGOS_DIAS, RANGOS_EDAD
+import figuras
 
-df['RANGO_DIAS'] = df['DIFERENCIA_DIAS'].apply(clasificar_dias)
+# Cargar los datos (snapshot local; la red solo se usa si no existe). Cada callback
+# toma la versión activa con conjunto.actual(); un refresco en segundo plano la reemplaza
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+conjunto.iniciar()
+CUANTILES = {'median': 0.5, 'p90': 0.9}
 
-# Preparar datos de fecha
-df['DIA_SOLICITACITA'] = pd.to_datetime(df['DIA_SOLICITACITA'], errors='coerce')
-df['MES'] = df['DIA_SOLICITACITA'].dt.to_period('M').astype(str)
+def version_actual():
+    return conjunto.actual().version
 
 # Crear servidor Flask compartido
 server = Flask(__name__)
@@ -162,511 +143,906 @@ def index():
     </html>
     """)
 
+# Duración y tamaño de cada petición, y de cada callback por etapa (metricas.py)
+@server.before_request
+def iniciar_metricas():
+    metricas.iniciar_peticion()
+
+@server.after_request
+def terminar_metricas(respuesta):
+    return metricas.terminar_peticion(respuesta)
+
+@server.route('/metrics')
+def metrics():
+    cuerpo, tipo = metricas.exponer()
+    return Response(cuerpo, content_type=tipo)
+
+# Perfiles por muestreo de peticiones individuales (perfilador.py); las rutas de admin
+# piden el mismo token, en la cabecera X-Perfil o en ?token=
+@server.before_request
+def iniciar_perfil():
+    perfilador.iniciar_peticion()
+
+@server.after_request
+def terminar_perfil(respuesta):
+    return perfilador.terminar_peticion(respuesta)
+
+def exigir_token_perfiles():
+    if not perfilador.habilitado():
+        abort(404)
+    if not perfilador.token_valido(perfilador.token_de_peticion()):
+        abort(403)
+
+@server.route('/admin/perfiles')
+def perfiles():
+    exigir_token_perfiles()
+    resumenes = []
+    for identificador in perfilador.listar():
+        metadatos = perfilador.leer(identificador)
+        if metadatos is not None:
+            metadatos.pop('top', None)
+            resumenes.append(metadatos)
+    return jsonify(resumenes)
+
+def ruta_local(url):
+    # Solo rutas de este mismo sitio: '//otro.host/x' o '/\otro.host' también empiezan con '/'
+    partes = urlsplit(url.replace('\\', '/'))
+    return url.startswith('/') and not partes.scheme and not partes.netloc
+
+# Deja una cookie para que se perfilen las peticiones de este navegador durante 10 minutos;
+# con ?siguiente=/asegurados/ redirige ahí
+@server.route('/admin/perfiles/activar')
+def activar_perfiles():
+    exigir_token_perfiles()
+    siguiente = request.args.get('siguiente', '')
+    respuesta = redirect(siguiente) if ruta_local(siguiente) \
+        else jsonify(estado='perfilando', segundos=perfilador.DURACION_COOKIE_SEG)
+    respuesta.set_cookie(perfilador.COOKIE, perfilador.token_de_peticion(),
+                         max_age=perfilador.DURACION_COOKIE_SEG, httponly=True, samesite='Strict')
+    return respuesta
+
+@server.route('/admin/perfiles/desactivar')
+def desactivar_perfiles():
+    exigir_token_perfiles()
+    respuesta = jsonify(estado='sin perfilar')
+    respuesta.delete_cookie(perfilador.COOKIE)
+    return respuesta
+
+@server.route('/admin/perfiles/<identificador>')
+def perfil(identificador):
+    exigir_token_perfiles()
+    metadatos = perfilador.leer(identificador)
+    if metadatos is None:
+        abort(404)
+    return jsonify(metadatos)
+
+# Pilas colapsadas: flamegraph.pl perfil.folded > perfil.svg, o abrirlo en speedscope
+@server.route('/admin/perfiles/<identificador>.folded')
+def perfil_folded(identificador):
+    exigir_token_perfiles()
+    ruta = perfilador.ruta_perfil(identificador, 'folded')
+    if ruta is None:
+        abort(404)
+    return send_file(os.path.abspath(ruta), mimetype='text/plain', as_attachment=True,
+                     download_name=f'{identificador}.folded')
+
+# Respuestas comprimidas con br o gzip, según lo que acepte el navegador, desde cierto
+# tamaño: HTML, JSON de callbacks y layout, JS y CSS. Se registra después de los hooks de
+# métricas para que flask_respuesta_bytes cuente los bytes que salen comprimidos
+server.config.update(
+    COMPRESS_ALGORITHM=os.environ.get('COMPRESION_ALGORITMOS', 'br,gzip'),
+    COMPRESS_MIN_SIZE=int(os.environ.get('COMPRESION_MIN_BYTES', '1024')),
+    COMPRESS_LEVEL=6,
+    COMPRESS_BR_LEVEL=4,
+)
+Compress(server)
+
+# Validación con ETag: el índice, las páginas de Dash, el layout y las dependencias solo
+# cambian con una versión nueva de los datos o del código. Se responden con no-cache y un
+# ETag débil de esa versión, así una visita repetida recibe un 304 sin cuerpo
+REVISION = os.environ.get('RENDER_GIT_COMMIT') or str(int(os.path.getmtime(__file__)))
+UN_ANO = 365 * 24 * 3600
+
+def rutas_validadas():
+    return {'/', '/_dash-layout', '/_dash-dependencies'} | {p['path'] for p in dash.page_registry.values()}
+
+def etag_version():
+    return f'{version_actual()}-{REVISION}'
+
+@server.before_request
+def responder_no_modificado():
+    if request.method != 'GET' or request.path not in rutas_validadas():
+        return None
+    etag = etag_version()
+    # flask-compress agrega ':br' o ':gzip' al ETag que envió
+    if any(tag.split(':')[0] == etag for tag in request.if_none_match.as_set(include_weak=True)):
+        respuesta = Response(status=304)
+        respuesta.set_etag(etag, weak=True)
+        respuesta.cache_control.no_cache = True
+        return respuesta
+    return None
+
+@server.after_request
+def encabezados_cache(respuesta):
+    if request.method != 'GET' or respuesta.status_code != 200:
+        return respuesta
+    if request.path in rutas_validadas():
+        respuesta.set_etag(etag_version(), weak=True)
+        respuesta.cache_control.no_cache = True
+    elif (request.path.startswith(('/assets/', '/static/')) and ('m' in request.args or 'v' in request.args)) \
+            or respuesta.cache_control.max_age == UN_ANO:
+        # Recursos con versión en la URL (los assets llevan ?m=, los bundles de Dash una
+        # huella en el nombre): otra versión es otra URL, así que no se revalidan nunca.
+        # send_file deja no-cache, que obligaría a revalidar igual
+        respuesta.cache_control.no_cache = None
+        respuesta.cache_control.must_revalidate = False
+        respuesta.cache_control.public = True
+        respuesta.cache_control.max_age = UN_ANO
+        respuesta.cache_control.immutable = True
+    elif request.path.startswith(('/assets/', '/static/')):
+        respuesta.cache_control.no_cache = True
+    return respuesta
+
+# Aciertos y fallos del cache de figuras, sumados entre todos los workers
+@server.route('/cache-figuras')
+def cache_figuras_estadisticas():
+    return jsonify(estadisticas())
+
+# Una sola app Dash con páginas: un bundle de React/Plotly, un registro de callbacks y
+# navegación entre tableros sin recargar. La ruta '/' sigue siendo el índice de Flask,
+# que se registró antes. Cada layout se arma recién cuando se visita su página
+app = dash.Dash(__name__, server=server, url_base_pathname='/', use_pages=True, pages_folder='',
+                suppress_callback_exceptions=True)
+# Cada petición de callback lleva el número de orden de su pestaña (assets/coalescer.js)
+app.renderer = 'var renderer = new DashRenderer({request_pre: window.dash_clientside.coalescer.numerar});'
+
+@server.before_request
+def registrar_peticion():
+    if request.path == '/_dash-update-component':
+        coalescer.registrar()
+
+# 'mouseup' calcula al soltar el slider; 'drag' actualiza mientras se arrastra y las
+# peticiones intermedias que quedan superadas se descartan
+ACTUALIZAR_SLIDERS = os.environ.get('SLIDERS_ACTUALIZAR', 'mouseup')
+
+# Histogramas pre-agrupados: se envía un conteo por tramo del esquema (con ceros),
+# no una categoría por paciente para que el navegador la cuente
+@metricas.etapa('figura')
+def histograma_conteos(conteos, rango, eje, titulo):
+    etiquetas = rango['etiquetas']
+    conteos = pd.Series(conteos.to_numpy(), index=conteos.index.astype(str)).reindex(etiquetas, fill_value=0)
+    return figuras.barras(etiquetas, conteos.to_numpy(), titulo, eje_x=eje, eje_y='count', orden=etiquetas)
+
+# Figuras de detalle (drill-down): el layout trae un esqueleto con una sola traza. Los
+# callbacks principales dejan en un dcc.Store los conteos cruzados del estado de filtros
+# actual y el clic se resuelve en el navegador (assets/drilldown.js), sin pedido al servidor
+# Los esqueletos no dependen de los datos: se arman una vez al importar, como dicts (con
+# cualquier FIGURAS_MOTOR), y cada visita a una página los reutiliza
+def pie_vacio(titulo, alto=None):
+    layout = {'template': figuras.plantilla('plotly'), 'legend': {'tracegroupgap': 0}, 'title': {'text': titulo}}
+    if alto is not None:
+        layout['height'] = alto
+    return {
+        'data': [{'type': 'pie', 'labels': [], 'values': [], 'domain': {'x': [0.0, 1.0], 'y': [0.0, 1.0]},
+                  'hovertemplate': 'label=%{label}<br>value=%{value}<extra></extra>', 'showlegend': True}],
+        'layout': layout,
+    }
+
+def barras_vacias(titulo, eje_x, tickangle=None):
+    eje_y = 'Días de Espera Promedio'
+    extra_x = {'tickangle': tickangle} if tickangle is not None else {}
+    return {
+        'data': [{'type': 'bar', 'x': [], 'y': [], 'orientation': 'v', 'showlegend': False,
+                  'marker': {'color': figuras.COLOR},
+                  'hovertemplate': f'{eje_x}=%{{x}}<br>{eje_y}=%{{y}}<extra></extra>'}],
+        'layout': {
+            'template': figuras.plantilla('plotly_white'),
+            'xaxis': figuras.eje(eje_x, 'y', **extra_x),
+            'yaxis': figuras.eje(eje_y, 'x'),
+            'title': {'text': titulo},
+            'barmode': 'relative',
+        },
+    }
+
+PIE_HISTOGRAMA_VACIO = pie_vacio("Haga clic en una barra del histograma", 500)
+PIE_TIEMPO_VACIO = pie_vacio("Seleccione un período en la línea de tiempo")
+BARRAS_MODALIDAD_VACIAS = barras_vacias("Seleccione una modalidad en el gráfico de pastel", 'ESPECIALIDAD', tickangle=45)
+BARRAS_SEGURO_VACIAS = barras_vacias("Seleccione un estado en el gráfico de pastel", 'SEXO')
+
+@metricas.etapa('figura')
+def cruce_conteos(conteos):
+    # Conteos por (valor clicable × especialidad): una fila por valor clicable y las
+    # columnas en orden de categoría, sin las que quedaron en cero
+    if conteos.empty:
+        return {'n': TOP_N, 'columnas': [], 'filas': {}}
+    tabla = conteos.unstack(fill_value=0)
+    tabla = tabla.loc[:, tabla.to_numpy().any(axis=0)]
+    return {
+        'n': TOP_N,
+        'columnas': tabla.columns.astype(str).tolist(),
+        'filas': {str(fila): valores.tolist() for fila, valores in zip(tabla.index, tabla.to_numpy())},
+    }
+
+@metricas.etapa('figura')
+def cruce_medias(medidas):
+    # Citas con días y suma de días por (valor clicable × desglose); el navegador saca las medias
+    if medidas.empty:
+        return {'columnas': [], 'filas': {}}
+    n = medidas['n_dias'].unstack(fill_value=0)
+    suma = medidas['suma'].unstack(fill_value=0).reindex(index=n.index, columns=n.columns)
+    return {
+        'columnas': n.columns.astype(str).tolist(),
+        'filas': {str(fila): {'n': cantidades.tolist(), 'suma': sumas.tolist()}
+                  for fila, cantidades, sumas in zip(n.index, n.to_numpy(), suma.to_numpy())},
+    }
+
 # App 1: Por Rango de Edad
-app_edad = dash.Dash(__name__, server=server, url_base_pathname='/edad/')
-app_edad.layout = html.Div([
-    html.Div([
-        html.H1("📊 Distribución por Rango de Edad", style={'textAlign': 'center', 'color': '#2c3e50'}),
-        
-        # Filtros
+def layout_edad(**_):
+    d = conjunto.actual()
+    return html.Div([
         html.Div([
+            html.H1("📊 Distribución por Rango de Edad", style={'textAlign': 'center', 'color': '#2c3e50'}),
+            
+            # Filtros
             html.Div([
-                html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-especialidad-edad',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': esp, 'value': esp} for esp in sorted(df['ESPECIALIDAD'].unique())],
-                    value='Todas',
-                    style={'marginBottom': '10px'}
-                )
-            ], style={'width': '48%', 'display': 'inline-block'}),
+                html.Div([
+                    html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-especialidad-edad',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': esp, 'value': esp} for esp in d.valores['ESPECIALIDAD']],
+                        value='Todas',
+                        style={'marginBottom': '10px'}
+                    )
+                ], style={'width': '48%', 'display': 'inline-block'}),
+                
+                html.Div([
+                    html.Label("Filtrar por Sexo:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-sexo-edad',
+                        options=[{'label': 'Todos', 'value': 'Todos'}] + 
+                                [{'label': sexo, 'value': sexo} for sexo in d.valores['SEXO']],
+                        value='Todos',
+                        style={'marginBottom': '10px'}
+                    )
+                ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
+            ], style={'marginBottom': '20px'}),
             
             html.Div([
-                html.Label("Filtrar por Sexo:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-sexo-edad',
-                    options=[{'label': 'Todos', 'value': 'Todos'}] + 
-                            [{'label': sexo, 'value': sexo} for sexo in df['SEXO'].unique()],
-                    value='Todos',
-                    style={'marginBottom': '10px'}
+                html.Label("Rango de Días de Espera:", style={'fontWeight': 'bold'}),
+                dcc.RangeSlider(
+                    id='range-slider-edad',
+                    min=d.dias_min,
+                    max=d.dias_max,
+                    value=[d.dias_min, d.dias_max],
+                    marks={i: str(i) for i in range(0, int(d.dias_max), 20)},
+                    tooltip={"placement": "bottom", "always_visible": True},
+                    updatemode=ACTUALIZAR_SLIDERS
                 )
-            ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
-        ], style={'marginBottom': '20px'}),
-        
-        html.Div([
-            html.Label("Rango de Días de Espera:", style={'fontWeight': 'bold'}),
-            dcc.RangeSlider(
-                id='range-slider-edad',
-                min=df['DIFERENCIA_DIAS'].min(),
-                max=df['DIFERENCIA_DIAS'].max(),
-                value=[df['DIFERENCIA_DIAS'].min(), df['DIFERENCIA_DIAS'].max()],
-                marks={i: str(i) for i in range(0, int(df['DIFERENCIA_DIAS'].max()), 20)},
-                tooltip={"placement": "bottom", "always_visible": True}
-            )
-        ], style={'marginBottom': '30px'}),
+            ], style={'marginBottom': '30px'}),
+            
+        ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
         
-    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
-    
-    dcc.Graph(id='histogram-edad'),
-    dcc.Graph(id='pie-chart-edad')
-])
+        dcc.Graph(id='histogram-edad'),
+        dcc.Store(id='cruce-edad'),
+        dcc.Graph(id='pie-chart-edad', figure=PIE_HISTOGRAMA_VACIO)
+    ])
+
+dash.register_page('edad', path='/edad/', name='Distribución por Edad', layout=layout_edad)
 
-@app_edad.callback(
+def conteos_edad(especialidad, sexo, dias_range):
+    d = conjunto.actual()
+    return d.dias_edad.contar(['Rango de Edad', 'ESPECIALIDAD'], {'ESPECIALIDAD': especialidad, 'SEXO': sexo},
+                            minimo=dias_range[0], maximo=dias_range[1])
+
+@app.callback(
     [Output('histogram-edad', 'figure'),
-     Output('pie-chart-edad', 'figure')],
+     Output('cruce-edad', 'data')],
     [Input('dropdown-especialidad-edad', 'value'),
      Input('dropdown-sexo-edad', 'value'),
-     Input('range-slider-edad', 'value'),
-     Input('histogram-edad', 'clickData')]
+     Input('range-slider-edad', 'value')]
 )
-def update_edad_charts(especialidad, sexo, dias_range, clickData):
-    # Filtrar datos
-    filtered_df = df.copy()
-    
-    if especialidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['ESPECIALIDAD'] == especialidad]
-    if sexo != 'Todos':
-        filtered_df = filtered_df[filtered_df['SEXO'] == sexo]
-    
-    filtered_df = filtered_df[
-        (filtered_df['DIFERENCIA_DIAS'] >= dias_range[0]) & 
-        (filtered_df['DIFERENCIA_DIAS'] <= dias_range[1])
-    ]
+@metricas.medir_callback('edad', filtros=('especialidad', 'sexo'))
+@memoizar('edad', version_actual)
+def update_edad_charts(especialidad, sexo, dias_range):
+    d = conjunto.actual()
+    filtros = {'ESPECIALIDAD': especialidad, 'SEXO': sexo}
+    por_edad = d.dias_edad.contar('Rango de Edad', filtros, minimo=dias_range[0], maximo=dias_range[1])
+    total = d.dias_edad.contar([], filtros, minimo=dias_range[0], maximo=dias_range[1])
+    metricas.filas(total)
     
     # Histograma
-    fig_hist = px.histogram(
-        filtered_df,
-        x='Rango de Edad',
-        category_orders={'Rango de Edad': ["Niño", "Adolescente", "Joven", "Adulto", "Adulto mayor"]},
-        title=f'Distribución de Edades - {len(filtered_df)} pacientes',
-        template='plotly_white'
+    fig_hist = histograma_conteos(
+        por_edad,
+        RANGOS_EDAD,
+        'Rango de Edad',
+        f'Distribución de Edades - {total} pacientes'
     )
     
-    # Gráfico de pastel
-    if clickData is None:
-        fig_pie = px.pie(names=[], values=[], title="Haga clic en una barra del histograma", height=500)
-    else:
-        selected_range = clickData['points'][0]['x']
-        pie_df = filtered_df[filtered_df['Rango de Edad'] == selected_range].copy()
-        
-        if len(pie_df) > 0:
-            top_especialidades = pie_df['ESPECIALIDAD'].value_counts().nlargest(5)
-            pie_df['ESPECIALIDAD_AGRUPADA'] = pie_df['ESPECIALIDAD'].apply(
-                lambda x: x if x in top_especialidades.index else 'Otras'
-            )
-            
-            grouped = pie_df['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-            grouped.columns = ['ESPECIALIDAD', 'CUENTA']
-            fig_pie = px.pie(
-                grouped,
-                names='ESPECIALIDAD',
-                values='CUENTA',
-                title=f"Top 5 Especialidades - {selected_range} ({len(pie_df)} pacientes)",
-                height=600
-            )
-        else:
-            fig_pie = px.pie(names=[], values=[], title="No hay datos para mostrar", height=500)
-    
-    return fig_hist, fig_pie
+    return fig_hist, cruce_conteos(conteos_edad(especialidad, sexo, dias_range))
+
+# Gráfico de pastel: top de especialidades del rango clicado, en el navegador
+app.clientside_callback(
+    ClientsideFunction(namespace='drilldown', function_name='pieEdad'),
+    Output('pie-chart-edad', 'figure'),
+    [Input('histogram-edad', 'clickData'),
+     Input('cruce-edad', 'data')],
+    State('pie-chart-edad', 'figure')
+)
 
 # App 2: Por Rango de Días de Espera
-app_espera = dash.Dash(__name__, server=server, url_base_pathname='/espera/')
-app_espera.layout = html.Div([
-    html.Div([
-        html.H1("⏱️ Análisis de Tiempos de Espera", style={'textAlign': 'center', 'color': '#2c3e50'}),
-        
+def layout_espera(**_):
+    d = conjunto.actual()
+    return html.Div([
         html.Div([
-            html.Div([
-                html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-especialidad-espera',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': esp, 'value': esp} for esp in sorted(df['ESPECIALIDAD'].unique())],
-                    value='Todas'
-                )
-            ], style={'width': '32%', 'display': 'inline-block'}),
+            html.H1("⏱️ Análisis de Tiempos de Espera", style={'textAlign': 'center', 'color': '#2c3e50'}),
             
             html.Div([
-                html.Label("Modalidad de Atención:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-modalidad-espera',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': mod, 'value': mod} for mod in df['PRESENCIAL_REMOTO'].unique()],
-                    value='Todas'
-                )
-            ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'}),
+                html.Div([
+                    html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-especialidad-espera',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': esp, 'value': esp} for esp in d.valores['ESPECIALIDAD']],
+                        value='Todas'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block'}),
+                
+                html.Div([
+                    html.Label("Modalidad de Atención:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-modalidad-espera',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': mod, 'value': mod} for mod in d.valores['PRESENCIAL_REMOTO']],
+                        value='Todas'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'}),
+                
+                html.Div([
+                    html.Label("Rango de Edad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-edad-espera',
+                        options=[{'label': 'Todos', 'value': 'Todos'}] + 
+                                [{'label': edad, 'value': edad} for edad in RANGOS_EDAD['etiquetas']],
+                        value='Todos'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'})
+            ], style={'marginBottom': '20px'}),
             
-            html.Div([
-                html.Label("Rango de Edad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-edad-espera',
-                    options=[{'label': 'Todos', 'value': 'Todos'}] + 
-                            [{'label': edad, 'value': edad} for edad in ["Niño", "Adolescente", "Joven", "Adulto", "Adulto mayor"]],
-                    value='Todos'
-                )
-            ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'})
-        ], style={'marginBottom': '20px'}),
+        ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
         
-    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
-    
-    dcc.Graph(id='histogram-espera'),
-    dcc.Graph(id='pie-chart-espera')
-])
+        dcc.Graph(id='histogram-espera'),
+        dcc.Store(id='cruce-espera'),
+        dcc.Graph(id='pie-chart-espera', figure=PIE_HISTOGRAMA_VACIO)
+    ])
+
+dash.register_page('espera', path='/espera/', name='Tiempos de Espera', layout=layout_espera)
+
+def filtros_espera(especialidad, modalidad, edad):
+    return {
+        'ESPECIALIDAD': especialidad,
+        'PRESENCIAL_REMOTO': modalidad,
+        'Rango de Edad': edad,
+    }
 
-@app_espera.callback(
+def conteos_espera(especialidad, modalidad, edad):
+    d = conjunto.actual()
+    return d.cubo.contar(['RANGO_DIAS', 'ESPECIALIDAD'], filtros_espera(especialidad, modalidad, edad))
+
+@app.callback(
     [Output('histogram-espera', 'figure'),
-     Output('pie-chart-espera', 'figure')],
+     Output('cruce-espera', 'data')],
     [Input('dropdown-especialidad-espera', 'value'),
      Input('dropdown-modalidad-espera', 'value'),
-     Input('dropdown-edad-espera', 'value'),
-     Input('histogram-espera', 'clickData')]
+     Input('dropdown-edad-espera', 'value')]
 )
-def update_espera_charts(especialidad, modalidad, edad, clickData):
-    filtered_df = df.copy()
-    
-    if especialidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['ESPECIALIDAD'] == especialidad]
-    if modalidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['PRESENCIAL_REMOTO'] == modalidad]
-    if edad != 'Todos':
-        filtered_df = filtered_df[filtered_df['Rango de Edad'] == edad]
+@metricas.medir_callback('espera', filtros=('especialidad', 'modalidad', 'edad'))
+@memoizar('espera', version_actual)
+def update_espera_charts(especialidad, modalidad, edad):
+    d = conjunto.actual()
+    conteos = conteos_espera(especialidad, modalidad, edad)
+    total = d.cubo.total(filtros_espera(especialidad, modalidad, edad))
+    metricas.filas(total)
     
-    fig_hist = px.histogram(
-        filtered_df,
-        x='RANGO_DIAS',
-        category_orders={'RANGO_DIAS': ["0-9", "10-19", "20-29", "30-39", "40-49", "50-59", "60-69", "70-79", "80-89", "90+"]},
-        title=f'Distribución de Tiempos de Espera - {len(filtered_df)} pacientes',
-        labels={'RANGO_DIAS': 'Rango de Días'},
-        template='plotly_white'
+    fig_hist = histograma_conteos(
+        conteos.groupby(level='RANGO_DIAS', observed=True).sum(),
+        RANGOS_DIAS,
+        'Rango de Días',
+        f'Distribución de Tiempos de Espera - {total} pacientes'
     )
     
-    if clickData is None:
-        fig_pie = px.pie(names=[], values=[], title="Haga clic en una barra del histograma", height=500)
-    else:
-        selected_range = clickData['points'][0]['x']
-        pie_df = filtered_df[filtered_df['RANGO_DIAS'] == selected_range].copy()
-        
-        if len(pie_df) > 0:
-            top_especialidades = pie_df['ESPECIALIDAD'].value_counts().nlargest(5)
-            pie_df['ESPECIALIDAD_AGRUPADA'] = pie_df['ESPECIALIDAD'].apply(
-                lambda x: x if x in top_especialidades.index else 'Otras'
-            )
-            
-            grouped = pie_df['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-            grouped.columns = ['ESPECIALIDAD', 'CUENTA']
-            fig_pie = px.pie(
-                grouped,
-                names='ESPECIALIDAD',
-                values='CUENTA',
-                title=f"Top 5 Especialidades - Espera {selected_range} días ({len(pie_df)} pacientes)",
-                height=600
-            )
-        else:
-            fig_pie = px.pie(names=[], values=[], title="No hay datos para mostrar", height=500)
-    
-    return fig_hist, fig_pie
+    return fig_hist, cruce_conteos(conteos)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='drilldown', function_name='pieEspera'),
+    Output('pie-chart-espera', 'figure'),
+    [Input('histogram-espera', 'clickData'),
+     Input('cruce-espera', 'data')],
+    State('pie-chart-espera', 'figure')
+)
 
 # App 3: Por Modalidad de Cita
-app_modalidad = dash.Dash(__name__, server=server, url_base_pathname='/modalidad/')
-app_modalidad.layout = html.Div([
-    html.Div([
-        html.H1("💻 Análisis de Modalidad de Atención", style={'textAlign': 'center', 'color': '#2c3e50'}),
-        
+def layout_modalidad(**_):
+    return html.Div([
         html.Div([
-            html.Div([
-                html.Label("Filtrar por Rango de Edad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-edad-modalidad',
-                    options=[{'label': 'Todos', 'value': 'Todos'}] + 
-                            [{'label': edad, 'value': edad} for edad in ["Niño", "Adolescente", "Joven", "Adulto", "Adulto mayor"]],
-                    value='Todos'
-                )
-            ], style={'width': '48%', 'display': 'inline-block'}),
+            html.H1("💻 Análisis de Modalidad de Atención", style={'textAlign': 'center', 'color': '#2c3e50'}),
             
             html.Div([
-                html.Label("Umbral de Días de Espera:", style={'fontWeight': 'bold'}),
-                dcc.Slider(
-                    id='slider-umbral-modalidad',
-                    min=0,
-                    max=100,
-                    value=30,
-                    marks={i: str(i) for i in range(0, 101, 20)},
-                    tooltip={"placement": "bottom", "always_visible": True}
-                )
-            ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
-        ], style={'marginBottom': '20px'}),
+                html.Div([
+                    html.Label("Filtrar por Rango de Edad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-edad-modalidad',
+                        options=[{'label': 'Todos', 'value': 'Todos'}] + 
+                                [{'label': edad, 'value': edad} for edad in RANGOS_EDAD['etiquetas']],
+                        value='Todos'
+                    )
+                ], style={'width': '48%', 'display': 'inline-block'}),
+                
+                html.Div([
+                    html.Label("Umbral de Días de Espera:", style={'fontWeight': 'bold'}),
+                    dcc.Slider(
+                        id='slider-umbral-modalidad',
+                        min=0,
+                        max=100,
+                        value=30,
+                        marks={i: str(i) for i in range(0, 101, 20)},
+                        tooltip={"placement": "bottom", "always_visible": True},
+                        updatemode=ACTUALIZAR_SLIDERS
+                    )
+                ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
+            ], style={'marginBottom': '20px'}),
+            
+        ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
         
-    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
-    
-    html.Div([
-        dcc.Graph(id='pie-modalidad', style={'display': 'inline-block', 'width': '50%'}),
-        dcc.Graph(id='metric-card-modalidad', style={'display': 'inline-block', 'width': '50%'})
-    ]),
-    dcc.Graph(id='bar-especialidad-modalidad')
-])
+        html.Div([
+            dcc.Graph(id='pie-modalidad', style={'display': 'inline-block', 'width': '50%'}),
+            dcc.Graph(id='metric-card-modalidad', style={'display': 'inline-block', 'width': '50%'})
+        ]),
+        dcc.Store(id='cruce-modalidad'),
+        dcc.Graph(
+            id='bar-especialidad-modalidad',
+            figure=BARRAS_MODALIDAD_VACIAS
+        )
+    ])
 
-@app_modalidad.callback(
+dash.register_page('modalidad', path='/modalidad/', name='Modalidad de Atención', layout=layout_modalidad)
+
+@app.callback(
     [Output('pie-modalidad', 'figure'),
-     Output('bar-especialidad-modalidad', 'figure'),
-     Output('metric-card-modalidad', 'figure')],
+     Output('metric-card-modalidad', 'figure'),
+     Output('cruce-modalidad', 'data')],
     [Input('dropdown-edad-modalidad', 'value'),
-     Input('slider-umbral-modalidad', 'value'),
-     Input('pie-modalidad', 'clickData')]
+     Input('slider-umbral-modalidad', 'value')]
 )
-def update_modalidad_charts(edad, umbral, clickData):
-    filtered_df = df.copy()
-    
-    if edad != 'Todos':
-        filtered_df = filtered_df[filtered_df['Rango de Edad'] == edad]
+@metricas.medir_callback('modalidad', filtros=('edad',))
+@memoizar('modalidad', version_actual)
+def update_modalidad_charts(edad, umbral):
+    d = conjunto.actual()
+    filtros = {'Rango de Edad': edad}
     
     # Gráfico de pastel
-    fig_pie = px.pie(
-        filtered_df,
-        names='PRESENCIAL_REMOTO',
-        title=f'Distribución de Modalidades - {len(filtered_df)} citas',
-        template='plotly_white'
+    por_modalidad = d.cubo.contar('PRESENCIAL_REMOTO', filtros)
+    total_citas = d.cubo.total(filtros)
+    metricas.filas(total_citas)
+    fig_pie = figuras.pie(
+        por_modalidad.index.astype(str),
+        por_modalidad.to_numpy(),
+        f'Distribución de Modalidades - {total_citas} citas'
     )
     
-    # Métricas
-    total_citas = len(filtered_df)
-    citas_sobre_umbral = len(filtered_df[filtered_df['DIFERENCIA_DIAS'] > umbral])
+    # Métricas: "más de umbral días" es lo mismo que "al menos floor(umbral) + 1 días"
+    citas_sobre_umbral = d.dias_edad.contar([], filtros, minimo=math.floor(umbral) + 1)
     porcentaje_sobre_umbral = (citas_sobre_umbral / total_citas * 100) if total_citas > 0 else 0
+    p90 = d.dias_edad.cuantiles([], filtros, CUANTILES)['p90']
     
-    fig_metric = px.bar(
-        x=['Total de Citas', f'Citas > {umbral} días', '% Sobre Umbral'],
-        y=[total_citas, citas_sobre_umbral, porcentaje_sobre_umbral],
-        title='Métricas de Tiempo de Espera',
-        template='plotly_white'
+    fig_metric = figuras.barras(
+        ['Total de Citas', f'Citas > {umbral} días', '% Sobre Umbral', 'P90 Espera (días)'],
+        [total_citas, citas_sobre_umbral, porcentaje_sobre_umbral, 0 if math.isnan(p90) else p90],
+        'Métricas de Tiempo de Espera'
     )
     
-    # Gráfico de barras
-    if clickData is None:
-        fig_bar = px.bar(x=[], y=[], title="Seleccione una modalidad en el gráfico de pastel")
-    else:
-        modalidad = clickData['points'][0]['label']
-        modal_df = filtered_df[filtered_df['PRESENCIAL_REMOTO'] == modalidad]
-        mean_wait = modal_df.groupby('ESPECIALIDAD')['DIFERENCIA_DIAS'].mean().reset_index()
-        mean_wait = mean_wait.sort_values(by='DIFERENCIA_DIAS', ascending=False)
-        
-        fig_bar = px.bar(
-            mean_wait,
-            x='ESPECIALIDAD',
-            y='DIFERENCIA_DIAS',
-            title=f"Tiempo Promedio de Espera por Especialidad - {modalidad}",
-            labels={'DIFERENCIA_DIAS': 'Días de Espera Promedio'},
-            template='plotly_white'
-        )
-        fig_bar.update_xaxis(tickangle=45)
-    
-    return fig_pie, fig_bar, fig_metric
+    return fig_pie, fig_metric, cruce_medias(d.cubo.agregar(['PRESENCIAL_REMOTO', 'ESPECIALIDAD'], filtros))
+
+# Gráfico de barras: espera promedio por especialidad de la modalidad clicada, en el navegador
+app.clientside_callback(
+    ClientsideFunction(namespace='drilldown', function_name='barrasModalidad'),
+    Output('bar-especialidad-modalidad', 'figure'),
+    [Input('pie-modalidad', 'clickData'),
+     Input('cruce-modalidad', 'data')],
+    State('bar-especialidad-modalidad', 'figure')
+)
 
 # App 4: Por Estado de Seguro
-app_seguro = dash.Dash(__name__, server=server, url_base_pathname='/asegurados/')
-app_seguro.layout = html.Div([
-    html.Div([
-        html.H1("🛡️ Análisis de Estado del Seguro", style={'textAlign': 'center', 'color': '#2c3e50'}),
-        
+def layout_seguro(**_):
+    d = conjunto.actual()
+    return html.Div([
         html.Div([
-            html.Div([
-                html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-especialidad-seguro',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': esp, 'value': esp} for esp in sorted(df['ESPECIALIDAD'].unique())],
-                    value='Todas'
-                )
-            ], style={'width': '48%', 'display': 'inline-block'}),
+            html.H1("🛡️ Análisis de Estado del Seguro", style={'textAlign': 'center', 'color': '#2c3e50'}),
             
             html.Div([
-                html.Label("Estado de Atención:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-atencion-seguro',
-                    options=[{'label': 'Todos', 'value': 'Todos'}] + 
-                            [{'label': estado, 'value': estado} for estado in df['ATENDIDO'].unique()],
-                    value='Todos'
-                )
-            ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
-        ], style={'marginBottom': '20px'}),
+                html.Div([
+                    html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-especialidad-seguro',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': esp, 'value': esp} for esp in d.valores['ESPECIALIDAD']],
+                        value='Todas'
+                    )
+                ], style={'width': '48%', 'display': 'inline-block'}),
+                
+                html.Div([
+                    html.Label("Estado de Atención:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-atencion-seguro',
+                        options=[{'label': 'Todos', 'value': 'Todos'}] + 
+                                [{'label': estado, 'value': estado} for estado in d.valores['ATENDIDO']],
+                        value='Todos'
+                    )
+                ], style={'width': '48%', 'float': 'right', 'display': 'inline-block'})
+            ], style={'marginBottom': '20px'}),
+            
+        ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
         
-    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
-    
-    html.Div([
-        dcc.Graph(id='pie-seguro', style={'display': 'inline-block', 'width': '50%'}),
-        dcc.Graph(id='comparison-seguro', style={'display': 'inline-block', 'width': '50%'})
-    ]),
-    dcc.Graph(id='bar-espera-seguro')
-])
+        html.Div([
+            dcc.Graph(id='pie-seguro', style={'display': 'inline-block', 'width': '50%'}),
+            dcc.Graph(id='comparison-seguro', style={'display': 'inline-block', 'width': '50%'})
+        ]),
+        dcc.Store(id='cruce-seguro'),
+        dcc.Graph(id='bar-espera-seguro', figure=BARRAS_SEGURO_VACIAS)
+    ])
 
-@app_seguro.callback(
+dash.register_page('seguro', path='/asegurados/', name='Estado del Seguro', layout=layout_seguro)
+
+@app.callback(
     [Output('pie-seguro', 'figure'),
-     Output('bar-espera-seguro', 'figure'),
-     Output('comparison-seguro', 'figure')],
+     Output('comparison-seguro', 'figure'),
+     Output('cruce-seguro', 'data')],
     [Input('dropdown-especialidad-seguro', 'value'),
-     Input('dropdown-atencion-seguro', 'value'),
-     Input('pie-seguro', 'clickData')]
+     Input('dropdown-atencion-seguro', 'value')]
 )
-def update_seguro_charts(especialidad, atencion, clickData):
-    filtered_df = df.dropna(subset=['SEGURO']).copy()
-    
-    if especialidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['ESPECIALIDAD'] == especialidad]
-    if atencion != 'Todos':
-        filtered_df = filtered_df[filtered_df['ATENDIDO'] == atencion]
+@metricas.medir_callback('seguro', filtros=('especialidad', 'atencion'))
+@memoizar('seguro', version_actual)
+def update_seguro_charts(especialidad, atencion):
+    d = conjunto.actual()
+    filtros = {'ESPECIALIDAD': especialidad, 'ATENDIDO': atencion}
     
     # Gráfico de pastel
-    fig_pie = px.pie(
-        filtered_df,
-        names='SEGURO',
-        title=f'Distribución por Estado de Seguro - {len(filtered_df)} pacientes',
-        template='plotly_white'
+    por_seguro = d.cubo.contar('SEGURO', filtros)
+    metricas.filas(d.cubo.total(filtros))
+    fig_pie = figuras.pie(
+        por_seguro.index.astype(str),
+        por_seguro.to_numpy(),
+        f'Distribución por Estado de Seguro - {int(por_seguro.sum())} pacientes'
     )
     
     # Comparación de tiempos de espera
-    comparison_data = filtered_df.groupby('SEGURO')['DIFERENCIA_DIAS'].agg(['mean', 'median', 'std']).reset_index()
-    fig_comparison = px.bar(
-        comparison_data,
-        x='SEGURO',
-        y='mean',
-        title='Tiempo Promedio de Espera por Estado de Seguro',
-        labels={'mean': 'Días Promedio'},
-        template='plotly_white'
+    comparison_data = d.cubo.estadisticas('SEGURO', filtros).join(d.dias_seguro.cuantiles('SEGURO', filtros, CUANTILES))
+    fig_comparison = figuras.barras_agrupadas(
+        comparison_data.index.astype(str),
+        {
+            'Media': comparison_data['mean'].to_numpy(),
+            'Mediana': comparison_data['median'].to_numpy(),
+            'P90': comparison_data['p90'].to_numpy(),
+        },
+        'Tiempo de Espera por Estado de Seguro',
+        eje_x='SEGURO',
+        eje_y='Días',
+        leyenda='Medida'
     )
     
-    # Gráfico de barras por sexo
-    if clickData is None:
-        fig_bar = px.bar(x=[], y=[], title="Seleccione un estado en el gráfico de pastel")
-    else:
-        seguro = clickData['points'][0]['label']
-        seguro_df = filtered_df[filtered_df['SEGURO'] == seguro]
-        mean_wait = seguro_df.groupby('SEXO')['DIFERENCIA_DIAS'].mean().reset_index()
-        
-        fig_bar = px.bar(
-            mean_wait,
-            x='SEXO',
-            y='DIFERENCIA_DIAS',
-            title=f"Tiempo Promedio de Espera por Sexo - {seguro}",
-            labels={'DIFERENCIA_DIAS': 'Días de Espera Promedio'},
-            template='plotly_white'
-        )
-    
-    return fig_pie, fig_bar, fig_comparison
+    return fig_pie, fig_comparison, cruce_medias(d.cubo.agregar(['SEGURO', 'SEXO'], filtros))
+
+# Gráfico de barras por sexo del estado de seguro clicado, en el navegador
+app.clientside_callback(
+    ClientsideFunction(namespace='drilldown', function_name='barrasSeguro'),
+    Output('bar-espera-seguro', 'figure'),
+    [Input('pie-seguro', 'clickData'),
+     Input('cruce-seguro', 'data')],
+    State('bar-espera-seguro', 'figure')
+)
 
 # App 5: Línea de Tiempo
-app_tiempo = dash.Dash(__name__, server=server, url_base_pathname='/tiempo/')
-app_tiempo.layout = html.Div([
-    html.Div([
-        html.H1("📈 Análisis Temporal de Citas", style={'textAlign': 'center', 'color': '#2c3e50'}),
-        
+def layout_tiempo(**_):
+    d = conjunto.actual()
+    return html.Div([
         html.Div([
-            html.Div([
-                html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-especialidad-tiempo',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': esp, 'value': esp} for esp in sorted(df['ESPECIALIDAD'].unique())],
-                    value='Todas'
-                )
-            ], style={'width': '32%', 'display': 'inline-block'}),
+            html.H1("📈 Análisis Temporal de Citas", style={'textAlign': 'center', 'color': '#2c3e50'}),
             
             html.Div([
-                html.Label("Modalidad:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-modalidad-tiempo',
-                    options=[{'label': 'Todas', 'value': 'Todas'}] + 
-                            [{'label': mod, 'value': mod} for mod in df['PRESENCIAL_REMOTO'].unique()],
-                    value='Todas'
-                )
-            ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'}),
+                html.Div([
+                    html.Label("Filtrar por Especialidad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-especialidad-tiempo',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': esp, 'value': esp} for esp in d.valores['ESPECIALIDAD']],
+                        value='Todas'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block'}),
+                
+                html.Div([
+                    html.Label("Modalidad:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-modalidad-tiempo',
+                        options=[{'label': 'Todas', 'value': 'Todas'}] + 
+                                [{'label': mod, 'value': mod} for mod in d.valores['PRESENCIAL_REMOTO']],
+                        value='Todas'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'}),
+                
+                html.Div([
+                    html.Label("Estado de Atención:", style={'fontWeight': 'bold'}),
+                    dcc.Dropdown(
+                        id='dropdown-estado-tiempo',
+                        options=[{'label': 'Todos', 'value': 'Todos'}] + 
+                                [{'label': estado, 'value': estado} for estado in d.valores['ATENDIDO']],
+                        value='Todos'
+                    )
+                ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'})
+            ], style={'marginBottom': '20px'}),
             
-            html.Div([
-                html.Label("Estado de Atención:", style={'fontWeight': 'bold'}),
-                dcc.Dropdown(
-                    id='dropdown-estado-tiempo',
-                    options=[{'label': 'Todos', 'value': 'Todos'}] + 
-                            [{'label': estado, 'value': estado} for estado in df['ATENDIDO'].unique()],
-                    value='Todos'
-                )
-            ], style={'width': '32%', 'display': 'inline-block', 'marginLeft': '2%'})
-        ], style={'marginBottom': '20px'}),
+        ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
         
-    ], style={'padding': '20px', 'backgroundColor': '#f8f9fa', 'borderRadius': '10px', 'margin': '20px'}),
-    
-    dcc.Graph(id='grafico-lineal'),
-    html.Div([
-        dcc.Graph(id='grafico-pie-especialidades', style={'display': 'inline-block', 'width': '50%'}),
-        dcc.Graph(id='grafico-pie-atencion', style={'display': 'inline-block', 'width': '50%'})
+        dcc.RadioItems(
+            id='granularidad-tiempo',
+            options=[{'label': 'Día', 'value': 'D'}, {'label': 'Semana', 'value': 'W'}, {'label': 'Mes', 'value': 'M'}],
+            value='M',
+            inline=True,
+            style={'textAlign': 'center'}
+        ),
+        dcc.Graph(id='grafico-lineal'),
+        dcc.Store(id='cruce-tiempo'),
+        html.Div([
+            dcc.Graph(id='grafico-pie-especialidades', figure=PIE_TIEMPO_VACIO,
+                      style={'display': 'inline-block', 'width': '50%'}),
+            dcc.Graph(id='grafico-pie-atencion', figure=PIE_TIEMPO_VACIO,
+                      style={'display': 'inline-block', 'width': '50%'})
+        ])
     ])
-])
 
-@app_tiempo.callback(
+dash.register_page('tiempo', path='/tiempo/', name='Línea de Tiempo', layout=layout_tiempo)
+
+# Puntos máximos que se envían por línea; con zoom se reenvía solo la ventana visible
+MAX_PUNTOS_TIEMPO = int(os.environ.get('TIEMPO_MAX_PUNTOS', '400'))
+EJES_TIEMPO = {'D': 'DÍA', 'W': 'SEMANA', 'M': 'MES'}
+
+def filtros_tiempo(especialidad, modalidad, estado):
+    return {
+        'ESPECIALIDAD': especialidad,
+        'PRESENCIAL_REMOTO': modalidad,
+        'ATENDIDO': estado,
+    }
+
+@metricas.etapa('figura')
+def puntos_linea(serie, granularidad):
+    elegidos = lttb(serie.index.asi8, serie.to_numpy(), MAX_PUNTOS_TIEMPO)
+    serie = serie.iloc[elegidos]
+    return serie.index.strftime('%Y-%m' if granularidad == 'M' else '%Y-%m-%d'), serie.to_numpy()
+
+@app.callback(
     [Output('grafico-lineal', 'figure'),
-     Output('grafico-pie-especialidades', 'figure'),
-     Output('grafico-pie-atencion', 'figure')],
+     Output('cruce-tiempo', 'data')],
     [Input('dropdown-especialidad-tiempo', 'value'),
      Input('dropdown-modalidad-tiempo', 'value'),
      Input('dropdown-estado-tiempo', 'value'),
-     Input('grafico-lineal', 'clickData')]
+     Input('granularidad-tiempo', 'value')]
 )
-def update_tiempo_charts(especialidad, modalidad, estado, clickData):
-    filtered_df = df.copy()
-    
-    if especialidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['ESPECIALIDAD'] == especialidad]
-    if modalidad != 'Todas':
-        filtered_df = filtered_df[filtered_df['PRESENCIAL_REMOTO'] == modalidad]
-    if estado != 'Todos':
-        filtered_df = filtered_df[filtered_df['ATENDIDO'] == estado]
-    
+@metricas.medir_callback('tiempo', filtros=('especialidad', 'modalidad', 'estado'))
+@memoizar('tiempo', version_actual)
+def update_tiempo_charts(especialidad, modalidad, estado, granularidad):
+    d = conjunto.actual()
     # Línea de tiempo
-    citas_por_mes = filtered_df.groupby('MES').size().reset_index(name='CANTIDAD_CITAS')
-    fig_lineal = px.line(
-        citas_por_mes, 
-        x='MES', 
-        y='CANTIDAD_CITAS', 
-        markers=True,
-        title=f'Evolución Temporal de Citas - {len(filtered_df)} total',
-        template='plotly_white'
+    filtros = filtros_tiempo(especialidad, modalidad, estado)
+    serie = d.fechas_citas.serie(filtros, granularidad)
+    # El total sale del cubo: la serie no cuenta las citas con fecha que no se pudo leer
+    total = d.cubo.total(filtros)
+    metricas.filas(total)
+    x, y = puntos_linea(serie, granularidad)
+    fig_lineal = figuras.linea(
+        x,
+        y,
+        f'Evolución Temporal de Citas - {total} total',
+        eje_x=EJES_TIEMPO[granularidad],
+        eje_y='CANTIDAD_CITAS',
+        tickangle=45,
+        uirevision=f'{especialidad}|{modalidad}|{estado}|{granularidad}'
     )
-    fig_lineal.update_xaxis(tickangle=45)
     
-    # Gráficos de pastel
-    if clickData is None:
-        fig_especialidades = px.pie(names=[], values=[], title="Seleccione un mes en la línea de tiempo")
-        fig_atencion = px.pie(names=[], values=[], title="Seleccione un mes en la línea de tiempo")
+    return fig_lineal, cruce_tiempo(serie, filtros, granularidad)
+
+@metricas.etapa('figura')
+def cruce_tiempo(totales, filtros, granularidad):
+    # Por cada período con citas (clave: primer día): total, candidatas al top como pares
+    # [columna, citas] y citas por estado de atención. Del desglose por especialidad solo
+    # viajan las TOP_N mayores de cada período (empates: orden de categoría), que es lo que
+    # usa el pastel; el total incluye las citas sin especialidad, que van a "Otras"
+    d = conjunto.actual()
+    con_citas = totales.to_numpy() > 0
+    por_especialidad = d.fechas_citas.por_periodo('ESPECIALIDAD', filtros, granularidad).to_numpy()[con_citas]
+    mayores = np.argsort(-por_especialidad, axis=1, kind='stable')[:, :TOP_N]
+    por_atencion = d.fechas_citas.por_periodo('ATENDIDO', filtros, granularidad)
+    return {
+        'n': TOP_N,
+        'granularidad': granularidad,
+        'especialidades': d.fechas_citas.categorias['ESPECIALIDAD'].astype(str).tolist(),
+        'atencion': por_atencion.columns.astype(str).tolist(),
+        'periodos': {
+            fecha: {
+                'total': int(total),
+                'especialidades': [[int(i), int(fila[i])] for i in columnas if fila[i] > 0],
+                'atencion': atencion.tolist(),
+            }
+            for fecha, total, fila, columnas, atencion in zip(
+                totales.index[con_citas].strftime('%Y-%m-%d'), totales.to_numpy()[con_citas],
+                por_especialidad, mayores, por_atencion.to_numpy()[con_citas])
+        },
+    }
+
+def ventana_zoom(relayoutData):
+    # (desde, hasta) del eje x tras un zoom, (None, None) al volver a la vista completa;
+    # None si el evento no cambia el eje x (autosize, zoom solo en y, etc.)
+    relayoutData = relayoutData or {}
+    if relayoutData.get('xaxis.autorange'):
+        return None, None
+    if 'xaxis.range[0]' in relayoutData and 'xaxis.range[1]' in relayoutData:
+        rango = [relayoutData['xaxis.range[0]'], relayoutData['xaxis.range[1]']]
+    elif 'xaxis.range' in relayoutData:
+        rango = relayoutData['xaxis.range']
     else:
-        mes_seleccionado = clickData['points'][0]['x']
-       df_mes = filtered_df[filtered_df['MES'] == mes_seleccionado]
-       
-       if len(df_mes) > 0:
-           # Gráfico de especialidades
-           top_especialidades = df_mes['ESPECIALIDAD'].value_counts().nlargest(5)
-           df_mes_copy = df_mes.copy()
-           df_mes_copy['ESPECIALIDAD_AGRUPADA'] = df_mes_copy['ESPECIALIDAD'].apply(
-               lambda x: x if x in top_especialidades.index else 'Otras'
-           )
-           
-           grouped = df_mes_copy['ESPECIALIDAD_AGRUPADA'].value_counts().reset_index()
-           grouped.columns = ['ESPECIALIDAD', 'CUENTA']
-           
-           fig_especialidades = px.pie(
-               grouped, 
-               names='ESPECIALIDAD', 
-               values='CUENTA', 
-               title=f'Top 5 Especialidades - {mes_seleccionado} ({len(df_mes)} citas)'
-           )
-           
-           # Gráfico de atención
-           fig_atencion = px.pie(
-               df_mes, 
-               names='ATENDIDO', 
-               title=f'Estado de Atención - {mes_seleccionado}'
-           )
-       else:
-           fig_especialidades = px.pie(names=[], values=[], title="No hay datos para este mes")
-           fig_atencion = px.pie(names=[], values=[], title="No hay datos para este mes")
-   
-   return fig_lineal, fig_especialidades, fig_atencion
+        return None
+    return tuple(pd.Timestamp(fecha).strftime('%Y-%m-%d') for fecha in rango)
+
+@memoizar('tiempo_zoom', version_actual)
+def parche_linea(desde, hasta, especialidad, modalidad, estado, granularidad):
+    d = conjunto.actual()
+    serie = d.fechas_citas.serie(filtros_tiempo(especialidad, modalidad, estado), granularidad, desde, hasta)
+    x, y = puntos_linea(serie, granularidad)
+    parche = Patch()
+    parche['data'][0]['x'] = list(x)
+    parche['data'][0]['y'] = [int(v) for v in y]
+    return parche
+
+# Zoom: solo se reenvían los puntos de la ventana visible, muestreados con LTTB
+@app.callback(
+    Output('grafico-lineal', 'figure', allow_duplicate=True),
+    Input('grafico-lineal', 'relayoutData'),
+    [State('dropdown-especialidad-tiempo', 'value'),
+     State('dropdown-modalidad-tiempo', 'value'),
+     State('dropdown-estado-tiempo', 'value'),
+     State('granularidad-tiempo', 'value')],
+    prevent_initial_call=True
+)
+@metricas.medir_callback('tiempo_zoom', filtros=('especialidad', 'modalidad', 'estado'))
+def update_tiempo_zoom(relayoutData, especialidad, modalidad, estado, granularidad):
+    ventana = ventana_zoom(relayoutData)
+    if ventana is None:
+        raise PreventUpdate
+    return parche_linea(*ventana, especialidad, modalidad, estado, granularidad)
+
+# Gráficos de pastel del período clicado, en el navegador
+app.clientside_callback(
+    ClientsideFunction(namespace='drilldown', function_name='piesTiempo'),
+    [Output('grafico-pie-especialidades', 'figure'),
+     Output('grafico-pie-atencion', 'figure')],
+    [Input('grafico-lineal', 'clickData'),
+     Input('cruce-tiempo', 'data')],
+    [State('grafico-pie-especialidades', 'figure'),
+     State('grafico-pie-atencion', 'figure')]
+)
+
+ESTILO_ENLACE = {'marginRight': '20px', 'color': '#2980b9', 'fontWeight': 'bold', 'textDecoration': 'none'}
+
+app.layout = html.Div([
+    html.Div(
+        [html.A("🏠 Inicio", href='/', style=ESTILO_ENLACE)] +
+        [dcc.Link(pagina['name'], href=pagina['path'], style=ESTILO_ENLACE)
+         for pagina in dash.page_registry.values()],
+        style={'padding': '10px 20px', 'borderBottom': '1px solid #dee2e6'}
+    ),
+    dash.page_container
+])
+
+# Precalentamiento del cache: estado inicial de cada tablero (dropdowns por defecto,
+# slider completo, umbral 30) más las combinaciones frecuentes
+def vistas_iniciales(d):
+    return {
+        'edad': ([update_edad_charts],
+                 {'especialidad': 'Todas', 'sexo': 'Todos', 'dias_range': [int(d.dias_min), int(d.dias_max)]}),
+        'espera': ([update_espera_charts], {'especialidad': 'Todas', 'modalidad': 'Todas', 'edad': 'Todos'}),
+        'modalidad': ([update_modalidad_charts], {'edad': 'Todos', 'umbral': 30}),
+        'seguro': ([update_seguro_charts], {'especialidad': 'Todas', 'atencion': 'Todos'}),
+        'tiempo': ([update_tiempo_charts],
+                   {'especialidad': 'Todas', 'modalidad': 'Todas', 'estado': 'Todos', 'granularidad': 'M'}),
+    }
+
+# Especialidades más frecuentes que se precalientan en cada tablero que filtra por especialidad
+TOP_PRECALENTADO = int(os.environ.get('PRECALENTAR_TOP_ESPECIALIDADES', '5'))
+# JSON opcional: {"edad": [{"especialidad": "...", "sexo": "..."}], ...}; lo que falte toma el valor por defecto
+ARCHIVO_PRECALENTADO = os.environ.get('PRECALENTAR_ARCHIVO')
+# Cada cuántos segundos se busca una versión nueva de los datos (0 = nunca)
+INTERVALO_REFRESCO = int(os.environ.get('DATOS_REFRESCO_SEG', '900'))
+
+listo = threading.Event()
+
+
+def combinaciones_precalentado(d, vistas):
+    combinaciones = [(nombre, valores) for nombre, (_, valores) in vistas.items()]
+    top_especialidades = d.cubo.contar('ESPECIALIDAD', {}).nlargest(TOP_PRECALENTADO).index
+    for nombre, (_, valores) in vistas.items():
+        if 'especialidad' in valores:
+            combinaciones += [(nombre, {**valores, 'especialidad': esp}) for esp in top_especialidades]
+    if ARCHIVO_PRECALENTADO:
+        with open(ARCHIVO_PRECALENTADO, encoding='utf-8') as f:
+            for nombre, lista in json.load(f).items():
+                combinaciones += [(nombre, {**vistas[nombre][1], **cambios}) for cambios in lista]
+    return combinaciones
+
+
+def precalentar(d=None):
+    # d: una versión que todavía no está activa (refresco); por defecto la actual
+    inicio = time.perf_counter()
+    # Un contexto de app para todo el precalentamiento: todas las vistas usan la misma versión
+    with server.app_context():
+        if d is not None:
+            # conjunto.actual() devuelve la versión fijada en g durante el contexto
+            g.conjunto = d
+        d = conjunto.actual()
+        vistas = vistas_iniciales(d)
+        try:
+            combinaciones = combinaciones_precalentado(d, vistas)
+        except (OSError, ValueError, KeyError):
+            logger.exception("No se pudo leer %s; solo se precalientan las vistas iniciales", ARCHIVO_PRECALENTADO)
+            combinaciones = [(nombre, valores) for nombre, (_, valores) in vistas.items()]
+        for nombre, valores in combinaciones:
+            for funcion in vistas[nombre][0]:
+                # Cada callback recibe solo los valores de sus propios parámetros
+                parametros = inspect.signature(funcion).parameters
+                try:
+                    funcion(*[valores[parametro] for parametro in parametros])
+                except Exception:
+                    logger.exception("Falló el precalentamiento de %s con %s", funcion.__name__, valores)
+    listo.set()
+    logger.info("Cache precalentado (versión %s): %d vistas en %.1f s",
+                d.version, len(combinaciones), time.perf_counter() - inicio)
+
+
+def refrescar_datos():
+    # Fuera del camino de las peticiones: cuando aparece una versión nueva se precalienta y
+    # recién después se activa; las entradas del cache de la versión anterior salen por LRU
+    while True:
+        time.sleep(INTERVALO_REFRESCO)
+        try:
+            conjunto.refrescar(INTERVALO_REFRESCO, preparar=precalentar)
+        except Exception:
+            logger.exception("Falló el refresco de datos")
+
+
+# Render solo envía tráfico cuando esta ruta responde 200
+@server.route('/healthz')
+def healthz():
+    if not listo.is_set():
+        return jsonify(estado='precalentando'), 503
+    return jsonify(estado='listo', version=conjunto.actual().version)
+
+
+def iniciar_hilos():
+    # Los hilos no sobreviven al fork: con la app precargada por gunicorn los arranca
+    # cada worker desde post_fork (gunicorn.conf.py)
+    if not listo.is_set():
+        threading.Thread(target=precalentar, name='precalentamiento', daemon=True).start()
+    if INTERVALO_REFRESCO > 0:
+        threading.Thread(target=refrescar_datos, name='refresco-datos', daemon=True).start()
+
+
+if os.environ.get('PRECALENTAR', '1') != '1':
+    listo.set()
+
+if os.environ.get('GUNICORN_PRECARGA') == '1':
+    # El master precalienta una sola vez antes del fork y los workers nacen listos
+    if not listo.is_set():
+        precalentar()
+else:
+    iniciar_hilos()
 
 # Ejecutar el servidor
 if __name__ == '__main__':
-   server.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+    server.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
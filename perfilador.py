@@ -0,0 +1,178 @@
+import collections
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import request
+
+# Perfiles por muestreo de peticiones individuales, para ver en producción dónde se va el
+# tiempo de un callback lento (pandas, plotly, el cache) sin redeployar. Se activa solo
+# si PERFIL_TOKEN está definido. Se perfila una petición:
+#   - con la cabecera X-Perfil: <token>
+#   - desde un navegador con la cookie que deja /admin/perfiles/activar?token=<token>
+#   - al azar, una fracción PERFIL_FRACCION de los callbacks
+# Mientras dura la petición un hilo toma la pila del hilo que la atiende cada
+# PERFIL_INTERVALO_MS. Cada perfil se guarda como pilas colapsadas (.folded, lo que leen
+# flamegraph.pl y speedscope) y un resumen con las funciones más vistas (.json). Una
+# petición perfilada no lee el cache de figuras (sí lo actualiza), así se ve el cálculo real
+TOKEN = os.environ.get('PERFIL_TOKEN', '')
+FRACCION = float(os.environ.get('PERFIL_FRACCION', '0'))
+INTERVALO_SEG = float(os.environ.get('PERFIL_INTERVALO_MS', '5')) / 1000
+DIR_PERFILES = os.environ.get('PERFIL_DIR', 'data/perfiles')
+# Perfiles que se conservan; los más viejos se borran
+MAX_PERFILES = int(os.environ.get('PERFIL_MAX', '50'))
+COOKIE = 'perfil'
+# Con la cookie puesta el navegador pide también estáticos; esos no se perfilan
+SIN_PERFIL = ('/admin/', '/assets/', '/_dash-component-suites/', '/metrics', '/healthz')
+DURACION_COOKIE_SEG = 600
+TOP_FUNCIONES = 30
+
+_local = threading.local()
+
+
+def habilitado():
+    return bool(TOKEN)
+
+
+def token_valido(token):
+    return habilitado() and bool(token) and hmac.compare_digest(token, TOKEN)
+
+
+def token_de_peticion():
+    return request.headers.get('X-Perfil') or request.args.get('token') or request.cookies.get(COOKIE)
+
+
+def marco(codigo):
+    return f'{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})'
+
+
+class Muestreador(threading.Thread):
+    # Cuenta cuántas veces se vio cada pila del hilo `objetivo`, de la raíz a la hoja
+    def __init__(self, objetivo):
+        super().__init__(name='perfilador', daemon=True)
+        self.objetivo = objetivo
+        self.pilas = collections.Counter()
+        self.detener = threading.Event()
+
+    def run(self):
+        while not self.detener.wait(INTERVALO_SEG):
+            frame = sys._current_frames().get(self.objetivo)
+            pila = []
+            while frame is not None:
+                pila.append(marco(frame.f_code))
+                frame = frame.f_back
+            if pila:
+                self.pilas[tuple(reversed(pila))] += 1
+
+
+def iniciar_peticion():
+    _local.perfil = None
+    if not habilitado() or request.path.startswith(SIN_PERFIL):
+        return
+    elegido = token_valido(token_de_peticion())
+    if not elegido and FRACCION and request.path == '/_dash-update-component':
+        elegido = random.random() < FRACCION
+    if elegido:
+        muestreador = Muestreador(threading.get_ident())
+        _local.perfil = (muestreador, time.perf_counter())
+        muestreador.start()
+
+
+def perfilando():
+    # True si la petición en curso se está perfilando
+    return getattr(_local, 'perfil', None) is not None
+
+
+def resumen(pilas):
+    # Funciones con más muestras propias (en la hoja) y totales (en cualquier parte de la pila)
+    propias = collections.Counter()
+    totales = collections.Counter()
+    for pila, n in pilas.items():
+        propias[pila[-1]] += n
+        for funcion in set(pila):
+            totales[funcion] += n
+    muestras = sum(pilas.values()) or 1
+    return [
+        {'funcion': funcion, 'propias': n, 'totales': totales[funcion],
+         'propias_pct': round(100 * n / muestras, 1), 'totales_pct': round(100 * totales[funcion] / muestras, 1)}
+        for funcion, n in propias.most_common(TOP_FUNCIONES)
+    ]
+
+
+def terminar_peticion(respuesta):
+    perfil = getattr(_local, 'perfil', None)
+    if perfil is None:
+        return respuesta
+    _local.perfil = None
+    muestreador, inicio = perfil
+    muestreador.detener.set()
+    muestreador.join()
+    duracion = time.perf_counter() - inicio
+
+    cuerpo = request.get_json(silent=True) if request.is_json else None
+    identificador = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    metadatos = {
+        'id': identificador,
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'ruta': request.path,
+        'metodo': request.method,
+        'estado': respuesta.status_code,
+        'duracion_ms': round(duracion * 1000, 1),
+        'intervalo_ms': INTERVALO_SEG * 1000,
+        'muestras': sum(muestreador.pilas.values()),
+        'pid': os.getpid(),
+    }
+    if isinstance(cuerpo, dict):
+        metadatos['callback'] = cuerpo.get('output')
+        metadatos['entradas'] = {f"{e.get('id')}.{e.get('property')}": e.get('value')
+                                 for e in cuerpo.get('inputs', []) if isinstance(e, dict)}
+    metadatos['top'] = resumen(muestreador.pilas)
+    guardar(identificador, metadatos, muestreador.pilas)
+    respuesta.headers['X-Perfil-Id'] = identificador
+    return respuesta
+
+
+def guardar(identificador, metadatos, pilas):
+    # Se escribe a temporales y se renombra: la lista nunca ve un perfil a medias
+    os.makedirs(DIR_PERFILES, exist_ok=True)
+    base = os.path.join(DIR_PERFILES, identificador)
+    with open(f'{base}.folded.tmp', 'w', encoding='utf-8') as f:
+        for pila, n in pilas.most_common():
+            f.write(f"{';'.join(pila)} {n}\n")
+    with open(f'{base}.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(metadatos, f, ensure_ascii=False, default=str)
+    os.replace(f'{base}.folded.tmp', f'{base}.folded')
+    os.replace(f'{base}.json.tmp', f'{base}.json')
+    for viejo in listar()[MAX_PERFILES:]:
+        for extension in ('json', 'folded'):
+            try:
+                os.remove(os.path.join(DIR_PERFILES, f"{viejo}.{extension}"))
+            except FileNotFoundError:
+                pass
+
+
+def listar():
+    # Ids de los perfiles guardados, del más nuevo al más viejo
+    if not os.path.isdir(DIR_PERFILES):
+        return []
+    return sorted((nombre[:-5] for nombre in os.listdir(DIR_PERFILES) if nombre.endswith('.json')), reverse=True)
+
+
+def ruta_perfil(identificador, extension):
+    # None si el id no es uno de los guardados (también evita rutas fuera del directorio)
+    if identificador not in listar():
+        return None
+    return os.path.join(DIR_PERFILES, f'{identificador}.{extension}')
+
+
+def leer(identificador):
+    ruta = ruta_perfil(identificador, 'json')
+    if ruta is None:
+        return None
+    with open(ruta, encoding='utf-8') as f:
+        return json.load(f)